@@ -0,0 +1,163 @@
+import time
+import threading
+import metrics
+
+MAX_CONNECTIONS = 1000  # Client connections served at once
+MAX_CONNECTIONS_PER_CLIENT = 0  # Connections one client IP may hold; 0 is unlimited
+MAX_QUEUE = 1024  # Requests allowed to wait for a worker
+TARGET_DELAY = 0.05  # Seconds of queueing tolerated while overloaded
+INTERVAL = 0.5  # Seconds over which the shortest queueing delay is judged
+RETRY_AFTER = 1  # Seconds clients are told to wait after a 503
+
+rejected_total = metrics.Counter(
+    "admission_rejected_total",
+    "Connections and requests turned away with 503, by reason",
+    ("reason",),
+)
+queue_seconds = metrics.Histogram(
+    "admission_queue_delay_seconds", "Time requests waited for a worker"
+)
+
+
+class Overloaded(Exception):
+    """Raised when a connection or request is shed; the reason is its message."""
+
+
+def response(reason):
+    # A 503 that asks the client to come back, closing the connection
+    body = f"Service Unavailable: {reason}\n".encode("latin-1")
+    return (
+        b"HTTP/1.1 503 Service Unavailable\r\n"
+        + f"Retry-After: {RETRY_AFTER}\r\n".encode("latin-1")
+        + b"Content-Type: text/plain\r\n"
+        + f"Content-Length: {len(body)}\r\n".encode("latin-1")
+        + b"Connection: close\r\n\r\n"
+        + body
+    )
+
+
+def reject(client_socket, reason):
+    # Answer a connection that is being turned away and close it. The send
+    # does not block, so a slow client cannot stall the accept loop.
+    try:
+        client_socket.setblocking(False)
+        client_socket.send(response(reason))
+    except OSError:
+        pass
+    finally:
+        client_socket.close()
+
+
+class ConnectionLimiter:
+    """Caps open connections in total and per client IP."""
+
+    def __init__(self, max_connections=MAX_CONNECTIONS, max_per_client=MAX_CONNECTIONS_PER_CLIENT):
+        self.max_connections = max_connections
+        self.max_per_client = max_per_client
+        self.lock = threading.Lock()
+        self.total = 0
+        self.per_client = {}  # IP -> open connections
+
+    def acquire(self, ip):
+        """Count a new connection from ip, or raise Overloaded if it is over a limit."""
+        with self.lock:
+            if self.max_connections and self.total >= self.max_connections:
+                reason = "connections"
+            elif self.max_per_client and self.per_client.get(ip, 0) >= self.max_per_client:
+                reason = "client"
+            else:
+                self.total += 1
+                self.per_client[ip] = self.per_client.get(ip, 0) + 1
+                return
+        rejected_total.inc(reason)
+        if reason == "client":
+            raise Overloaded("too many connections from this client")
+        raise Overloaded("too many connections")
+
+    def release(self, ip):
+        with self.lock:
+            self.total -= 1
+            if self.per_client[ip] > 1:
+                self.per_client[ip] -= 1
+            else:
+                del self.per_client[ip]
+
+
+class RequestQueue:
+    """Bounded wait for a worker, shedding by queueing delay (CoDel).
+
+    join() takes a place in the queue and start() leaves it for a worker,
+    or run() does so around a call. At most max_waiting requests wait at
+    once. The delay of each request
+    is judged against the shortest delay seen in the last interval: while
+    that minimum stays under target the queue is only absorbing bursts,
+    and requests are let through unless they waited a whole interval.
+    Once even the minimum exceeds target a standing queue has formed, and
+    any request that waited longer than target is shed, so queueing stays
+    near target instead of growing with the load.
+
+    slots bounds the requests running at once; pass 0 when a thread pool
+    already does.
+    """
+
+    def __init__(self, slots=0, max_waiting=MAX_QUEUE, target=TARGET_DELAY, interval=INTERVAL):
+        self.slots = threading.Semaphore(slots) if slots else None
+        self.max_waiting = max_waiting
+        self.target = target
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.waiting = 0
+        self.overloaded = False
+        self.interval_end = time.monotonic() + interval
+        self.min_delay = None  # Shortest delay seen in the current interval
+
+    def join(self):
+        """Return the time the request joined, or raise Overloaded if the queue is full."""
+        with self.lock:
+            if self.waiting >= self.max_waiting:
+                full = True
+            else:
+                full = False
+                self.waiting += 1
+        if full:
+            rejected_total.inc("queue")
+            raise Overloaded("request queue full")
+        return time.monotonic()
+
+    def start(self, joined):
+        """Wait for a slot and leave the queue, or raise Overloaded if shed."""
+        try:
+            if self.slots is not None:
+                self.slots.acquire()
+        finally:
+            with self.lock:
+                self.waiting -= 1
+        now = time.monotonic()
+        delay = now - joined
+        queue_seconds.observe(delay)
+        if self._should_shed(delay, now):
+            self.finish()
+            rejected_total.inc("delay")
+            raise Overloaded("request queue too slow")
+
+    def finish(self):
+        if self.slots is not None:
+            self.slots.release()
+
+    def run(self, joined, fn, *args):
+        """Call fn(*args) once start(joined) lets the request through."""
+        self.start(joined)
+        try:
+            return fn(*args)
+        finally:
+            self.finish()
+
+    def _should_shed(self, delay, now):
+        with self.lock:
+            if now >= self.interval_end:
+                self.overloaded = self.min_delay is not None and self.min_delay > self.target
+                self.interval_end = now + self.interval
+                self.min_delay = None
+            if self.min_delay is None or delay < self.min_delay:
+                self.min_delay = delay
+            return delay > (self.target if self.overloaded else self.interval)
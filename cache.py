@@ -1,60 +1,549 @@
 import os
+import json
+import time
+import zlib
+import hashlib
 import logging
-from collections import OrderedDict
-from threading import Lock
+from collections import OrderedDict, namedtuple
+from itertools import count
+from threading import Event, Lock, Thread
+from eviction import POLICIES
+
+MEMORY_BYTES = 64 * 1024 * 1024  # Budget for hot entries held in memory
+DISK_BYTES = 1024 * 1024 * 1024  # Budget for entries demoted to disk
+SHARDS = 16  # Independently locked segments
+MIN_SHARD_ENTRIES = 8  # Fewer shards for small caches so each holds a few entries
+POLICY = "lru"  # Eviction policy, a key of eviction.POLICIES
+ZERO_COPY_MIN_BYTES = 4096  # Disk entries this large are handed out as open files
+INDEX_FILE = "index.log"
+INDEX_FLUSH_INTERVAL = 1.0  # Seconds index records may wait to be written
+INDEX_COMPACT_RATIO = 4  # Compact once the index has this many lines per live entry
+INDEX_COMPACT_MIN_LINES = 1024  # ...and at least this many lines
+NEGATIVE_TTL = 5  # Seconds an error response is reused
+NEGATIVE_ENTRIES = 1024  # Error responses kept at most
+
+# An entry in the memory tier, and the record of one stored on disk.
+# meta holds whatever the caller wants kept with the entry (validators).
+Entry = namedtuple("Entry", "value stored_at meta")
+DiskEntry = namedtuple("DiskEntry", "size version stored_at meta")
+# A large disk entry returned by lookup(key, as_file=True): an open file
+# the caller reads or sendfile()s and then closes
+FileEntry = namedtuple("FileEntry", "file size stored_at meta")
+
+log = logging.getLogger(__name__)
+
 
 class Cache:
-    def __init__(self, cache_dir, max_size):
+    """Two-tier cache: hot entries in memory, colder ones on disk.
+
+    Keys are hashed into independently locked shards, each with an equal
+    share of the entry and byte budgets, so lookups of different keys
+    rarely contend. Within a shard the memory tier is an LRU, and the
+    eviction policy (LRU, CLOCK or W-TinyLFU, see eviction.py) picks the
+    entries that leave the cache altogether. Eviction is per shard, which
+    makes the global order approximate.
+
+    The disk tier survives restarts: files are named by a hash of the key
+    and an append-only index records every file written or removed. On
+    startup the index is replayed, so the previous run's entries are hits
+    straight away. close() flushes the memory tier to disk as well.
+    """
+
+    def __init__(
+        self,
+        cache_dir,
+        max_size,
+        memory_bytes=MEMORY_BYTES,
+        disk_bytes=DISK_BYTES,
+        shards=SHARDS,
+        policy=POLICY,
+        zero_copy_min=ZERO_COPY_MIN_BYTES,
+    ):
         self.cache_dir = cache_dir
         self.max_size = max_size
-        self.cache = OrderedDict()
-        self.lock = Lock()
-
         if not os.path.exists(cache_dir):
             os.makedirs(cache_dir)
-        else:
-            self.clear()
+        self.index = _Index(os.path.join(cache_dir, INDEX_FILE))
+
+        records = self.index.load()
+        self.versions = count(max((r.version for r in records.values()), default=-1) + 1)
+
+        shards = max(1, min(shards, max_size // MIN_SHARD_ENTRIES))
+        self.shards = [
+            _Shard(
+                cache_dir,
+                -(-max_size // shards),
+                memory_bytes // shards,
+                disk_bytes // shards,
+                self.versions,
+                self.index,
+                POLICIES[policy],
+                zero_copy_min,
+            )
+            for _ in range(shards)
+        ]
+        self._restore(records)
+
+    def _shard(self, key):
+        return self.shards[zlib.crc32(key.encode("utf-8")) % len(self.shards)]
 
-    def _get_cache_path(self, key):
-        return os.path.join(self.cache_dir, key.replace("/", "_"))
+    def _restore(self, records):
+        # Keep indexed entries whose file is still there, remove other files
+        files = {
+            entry.name
+            for entry in os.scandir(self.cache_dir)
+            if entry.is_file() and entry.name != INDEX_FILE
+        }
+        removals = []
+        for key, record in records.items():
+            filename = _cache_filename(key, record.version)
+            if filename in files:
+                files.discard(filename)
+                removals += self._shard(key).restore(key, record)
+        removals += [os.path.join(self.cache_dir, filename) for filename in files]
+
+        for cache_path in removals:
+            try:
+                os.remove(cache_path)
+            except FileNotFoundError:
+                pass
+        restored = self._disk_records()
+        self.index.compact(restored)
+        self.index.start(self._disk_records)
+        log.info("Cache restored %d entries from %s", len(restored), self.cache_dir)
+
+    def _disk_records(self):
+        records = {}
+        for shard in self.shards:
+            with shard.lock:
+                records.update(shard.disk)
+        return records
 
     def exists(self, key):
-        with self.lock:
-            return key in self.cache
+        return self._shard(key).exists(key)
 
     def get(self, key):
-        with self.lock:
-            if key in self.cache:
-                logging.info(f"Cache hit for key: {key}")
-                self.cache.move_to_end(key)
-                cache_path = self._get_cache_path(key)
-                with open(cache_path, "rb") as f:
-                    return f.read()
-            logging.info(f"Cache miss for key: {key}")
-        return None
-
-    def put(self, key, value):
-        with self.lock:
-            # If the key already exists, move it to the end
-            if key in self.cache:
-                self.cache.move_to_end(key)
-            elif len(self.cache) >= self.max_size:
-                # Remove the oldest item if the cache is full
-                oldest_key, _ = self.cache.popitem(last=False)
-                os.remove(self._get_cache_path(oldest_key))
-
-            # Add the new key-value pair to the cache
-            self.cache[key] = True
-            cache_path = self._get_cache_path(key)
-            with open(cache_path, "wb") as f:
-                f.write(value)
+        """Return the cached bytes for key, or None, in one locked lookup."""
+        entry = self._shard(key).lookup(key)
+        return None if entry is None else entry.value
+
+    def lookup(self, key, as_file=False):
+        """Like get(), but return the whole Entry with stored_at and meta.
+
+        With as_file, an entry of at least zero_copy_min bytes that is on
+        disk comes back as a FileEntry instead. It is neither read nor
+        promoted to memory, so it can be sent straight from the page cache.
+        """
+        return self._shard(key).lookup(key, as_file)
+
+    def lookup_memory(self, key, usable):
+        """Return the memory-tier Entry for key if usable(entry), else None.
+
+        Never touches the disk, so an event loop may call it. A None result
+        is not counted as a miss; the caller goes on to lookup().
+        """
+        return self._shard(key).lookup_memory(key, usable)
+
+    def put(self, key, value, meta=None):
+        self._shard(key).put(key, value, meta)
+
+    def stats(self):
+        """Entry count, tier sizes and hit, miss and eviction counters."""
+        totals = dict.fromkeys(
+            ("entries", "memory_bytes", "disk_bytes", "hits", "misses", "evictions"), 0
+        )
+        for shard in self.shards:
+            with shard.lock:
+                totals["entries"] += len(shard.memory) + len(shard.disk)
+                totals["memory_bytes"] += shard.memory_used
+                totals["disk_bytes"] += shard.disk_used
+                totals["hits"] += shard.hits
+                totals["misses"] += shard.misses
+                totals["evictions"] += shard.evictions
+        return totals
+
+    def close(self):
+        """Write the memory tier to disk and compact the index."""
+        for shard in self.shards:
+            shard.flush()
+        self.index.stop()
+        self.index.compact(self._disk_records())
 
     def clear(self):
-        with self.lock:
+        for shard in self.shards:
+            shard.lock.acquire()
+        try:
             for filename in os.listdir(self.cache_dir):
                 file_path = os.path.join(self.cache_dir, filename)
                 try:
                     os.remove(file_path)
                 except Exception as e:
-                    print(f"Error removing cache file {file_path}: {e}")
-            self.cache.clear()
\ No newline at end of file
+                    log.warning("Error removing cache file %s: %s", file_path, e)
+            for shard in self.shards:
+                shard.reset()
+            self.index.compact({}, keep_pending=False)
+        finally:
+            for shard in self.shards:
+                shard.lock.release()
+
+
+class NegativeCache:
+    """Memory-only cache of error responses for a few seconds.
+
+    Keeps a burst of requests for a failing page from each reaching the
+    web server, without the errors taking space in, or being written to,
+    the main cache. Same lookup() and put() as Cache.
+    """
+
+    def __init__(self, ttl=NEGATIVE_TTL, max_entries=NEGATIVE_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # key -> Entry, oldest first
+        self.lock = Lock()
+
+    def lookup(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and time.time() - entry.stored_at >= self.ttl:
+                del self.entries[key]
+                entry = None
+        return entry
+
+    def put(self, key, value, meta=None):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = Entry(bytes(value), time.time(), meta or {})
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+def _cache_filename(key, version):
+    # Named by a hash of the key, so distinct keys never share a file. The
+    # version makes every write unique, so a slow write or delete of an
+    # old copy can never clobber the current one.
+    return f"{hashlib.sha256(key.encode('utf-8')).hexdigest()}.{version}"
+
+
+class _Index:
+    """Append-only log of disk entries, one JSON record per line.
+
+    Shards only queue records, under a lock that never waits on I/O; a
+    background thread writes them in batches every INDEX_FLUSH_INTERVAL.
+    Once the log holds INDEX_COMPACT_RATIO lines per live entry it is
+    rewritten with one line per entry, so it stays proportional to the
+    cache rather than to its history and replays quickly after a crash.
+    Records still queued at a crash are lost; their files are then not
+    indexed and are removed at the next start.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = Lock()  # Guards the file
+        self.pending_lock = Lock()  # Guards pending
+        self.pending = []  # Encoded records not yet written
+        self.file = None
+        self.lines = 0  # Lines in the file
+        self.stopped = Event()
+        self.thread = None
+
+    def load(self):
+        # Replay the log in order; the last put for a key wins
+        records = OrderedDict()
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break  # Torn final write from a crash
+                    key = record["key"]
+                    if record["op"] == "put":
+                        records.pop(key, None)
+                        records[key] = DiskEntry(
+                            record["size"],
+                            record["version"],
+                            record["stored_at"],
+                            record["meta"],
+                        )
+                    elif key in records and records[key].version == record["version"]:
+                        del records[key]
+        except FileNotFoundError:
+            pass
+        return records
+
+    def start(self, live_records):
+        """Start writing queued records; live_records() snapshots the live entries."""
+        self.thread = Thread(target=self._run, args=(live_records,), daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.flush()
+
+    def _run(self, live_records):
+        while not self.stopped.wait(INDEX_FLUSH_INTERVAL):
+            self.flush()
+            if self.lines > INDEX_COMPACT_MIN_LINES:
+                # Taken without the file lock: clear() holds every shard
+                # lock while it waits for that one
+                records = live_records()
+                if self.lines > INDEX_COMPACT_RATIO * len(records):
+                    self.compact(records)
+
+    def append_put(self, key, record):
+        self._append(_put_record(key, record))
+
+    def append_delete(self, key, version):
+        self._append({"op": "del", "key": key, "version": version})
+
+    def flush(self):
+        with self.lock:
+            self._write_pending()
+
+    def compact(self, records, keep_pending=True):
+        # Rewrite the log with one put per live entry, oldest first. Records
+        # queued meanwhile follow it: they are no older than the snapshot,
+        # so replaying them after it gives the same state.
+        ordered = sorted(records.items(), key=lambda item: item[1].version)
+        lines = [_encode_record(_put_record(key, record)) for key, record in ordered]
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+            temp_path = self.path + ".tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                f.writelines(lines)
+            os.replace(temp_path, self.path)
+            self.file = open(self.path, "a", encoding="utf-8")
+            self.lines = len(lines)
+            if not keep_pending:
+                with self.pending_lock:
+                    self.pending = []
+            self._write_pending()
+
+    def _append(self, record):
+        line = _encode_record(record)
+        with self.pending_lock:
+            self.pending.append(line)
+
+    def _write_pending(self):
+        # The caller holds self.lock, so batches reach the file in order
+        with self.pending_lock:
+            lines, self.pending = self.pending, []
+        if lines:
+            self.file.writelines(lines)
+            self.file.flush()
+            self.lines += len(lines)
+
+
+def _put_record(key, record):
+    return {
+        "op": "put",
+        "key": key,
+        "size": record.size,
+        "version": record.version,
+        "stored_at": record.stored_at,
+        "meta": record.meta,
+    }
+
+
+def _encode_record(record):
+    return json.dumps(record, separators=(",", ":")) + "\n"
+
+
+class _Shard:
+    """One lock-protected segment of the cache.
+
+    New and recently read entries live in the memory tier. When it runs
+    over its byte budget the least recently used entries are demoted to
+    disk, and a disk hit promotes the entry back. max_size caps the number
+    of entries across both tiers; the policy chooses which entries are
+    evicted to respect it and the disk budget. File reads and writes happen outside the
+    lock so hits on one entry never wait for disk I/O on another.
+    """
+
+    def __init__(
+        self, cache_dir, max_size, memory_bytes, disk_bytes, versions, index, policy, zero_copy_min
+    ):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.memory = OrderedDict()  # key -> Entry
+        self.disk = OrderedDict()  # key -> DiskEntry
+        self.writing = {}  # key -> Entry still being written to disk
+        self.memory_used = 0
+        self.disk_used = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.versions = versions  # Shared, so file versions never repeat
+        self.index = index
+        self.policy = policy(max_size)  # Holds every key in memory or disk
+        self.zero_copy_min = zero_copy_min
+        self.lock = Lock()
+
+    def _get_cache_path(self, key, version):
+        return os.path.join(self.cache_dir, _cache_filename(key, version))
+
+    def exists(self, key):
+        with self.lock:
+            return key in self.memory or key in self.disk
+
+    def lookup(self, key, as_file=False):
+        with self.lock:
+            self.policy.access(key)
+            if key in self.memory:
+                log.debug("Cache hit for key: %s", key)
+                self.hits += 1
+                self.memory.move_to_end(key)
+                return self.memory[key]
+            if key not in self.disk:
+                log.debug("Cache miss for key: %s", key)
+                self.misses += 1
+                return None
+            log.debug("Cache hit for key: %s", key)
+            self.hits += 1
+            if key in self.writing:
+                return self.writing[key]
+            self.disk.move_to_end(key)
+            record = self.disk[key]
+
+        try:
+            f = open(self._get_cache_path(key, record.version), "rb")
+        except FileNotFoundError:
+            return None  # Evicted while we were opening it
+        if as_file and record.size >= self.zero_copy_min:
+            # The open file stays readable even if the entry is evicted now
+            return FileEntry(f, record.size, record.stored_at, record.meta)
+        with f:
+            value = f.read()
+        entry = Entry(value, record.stored_at, record.meta)
+
+        # Promote the entry back to memory if nobody replaced it meanwhile
+        with self.lock:
+            if self.disk.get(key) != record:
+                return entry
+            del self.disk[key]
+            self.disk_used -= record.size
+            self._add_to_memory(key, entry)
+            writes, removals = self._enforce_budgets()
+        removals.append((key, record.version))
+        self._apply(writes, removals)
+        return entry
+
+    def lookup_memory(self, key, usable):
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is None or not usable(entry):
+                return None
+            self.policy.access(key)
+            log.debug("Cache hit for key: %s", key)
+            self.hits += 1
+            self.memory.move_to_end(key)
+            return entry
+
+    def put(self, key, value, meta=None):
+        entry = Entry(bytes(value), time.time(), meta or {})
+        with self.lock:
+            removals = self._discard(key)
+            self._add_to_memory(key, entry)
+            self.policy.add(key)
+            writes, evicted = self._enforce_budgets()
+        self._apply(writes, removals + evicted)
+
+    def restore(self, key, record):
+        """Add an entry replayed from the index; returns files to remove."""
+        with self.lock:
+            self.disk[key] = record
+            self.disk_used += record.size
+            self.policy.add(key)
+            _, removals = self._enforce_budgets()
+        return [self._get_cache_path(key, version) for key, version in removals]
+
+    def flush(self):
+        # Demote every memory entry so the disk tier holds the whole shard
+        with self.lock:
+            writes = []
+            while self.memory:
+                writes.append(self._demote())
+        self._apply(writes, [])
+
+    def reset(self):
+        # Caller holds self.lock and has removed the files
+        self.memory.clear()
+        self.disk.clear()
+        self.writing.clear()
+        self.policy.clear()
+        self.memory_used = 0
+        self.disk_used = 0
+
+    # The helpers below expect self.lock to be held, except _apply which
+    # does the file I/O they queue up after the lock is released.
+
+    def _add_to_memory(self, key, entry):
+        self.memory[key] = entry
+        self.memory_used += len(entry.value)
+
+    def _discard(self, key):
+        if key in self.memory:
+            self.memory_used -= len(self.memory.pop(key).value)
+        if key in self.disk:
+            record = self.disk.pop(key)
+            self.disk_used -= record.size
+            self.writing.pop(key, None)
+            return [(key, record.version)]
+        return []
+
+    def _demote(self):
+        key, entry = self.memory.popitem(last=False)
+        self.memory_used -= len(entry.value)
+        record = DiskEntry(len(entry.value), next(self.versions), entry.stored_at, entry.meta)
+        self.disk[key] = record
+        self.disk_used += record.size
+        self.writing[key] = entry
+        return key, entry, record
+
+    def _enforce_budgets(self):
+        writes, removals = [], []
+
+        # Demote the coldest memory entries until the hot tier fits
+        while self.memory_used > self.memory_bytes:
+            writes.append(self._demote())
+
+        # Evict the policy's victims, from either tier, until both limits hold
+        while self.disk_used > self.disk_bytes or (
+            len(self.memory) + len(self.disk) > self.max_size
+        ):
+            self.evictions += 1
+            key = self.policy.victim()
+            if key in self.disk:
+                record = self.disk.pop(key)
+                self.disk_used -= record.size
+                self.writing.pop(key, None)
+                removals.append((key, record.version))
+            else:
+                self.memory_used -= len(self.memory.pop(key).value)
+        return writes, removals
+
+    def _apply(self, writes, removals):
+        for key, entry, record in writes:
+            cache_path = self._get_cache_path(key, record.version)
+            with open(cache_path, "wb") as f:
+                f.write(entry.value)
+            with self.lock:
+                if self.writing.get(key) is entry:
+                    del self.writing[key]
+                current = self.disk.get(key) == record
+            if current:
+                self.index.append_put(key, record)
+            else:
+                removals.append((key, record.version))  # Evicted or promoted mid-write
+
+        for key, version in removals:
+            try:
+                os.remove(self._get_cache_path(key, version))
+            except FileNotFoundError:
+                continue
+            self.index.append_delete(key, version)
@@ -0,0 +1,136 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+import metrics
+
+WINDOW = 10  # Seconds of calls the failure rate is computed over
+MIN_CALLS = 5  # Calls needed in the window before the breaker may open
+FAILURE_RATE = 0.5  # Share of failed or slow calls that opens the breaker
+SLOW_CALL = 2.0  # Seconds after which a successful call still counts as failed
+OPEN_SECONDS = 5.0  # Seconds an open breaker fails fast before probing
+MAX_ORIGINS = 1024  # Breakers kept before the least recently used is dropped
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+rejected_total = metrics.Counter(
+    "proxy_circuit_rejected_total",
+    "Requests failed fast because the origin's circuit breaker was open",
+    ("origin",),
+)
+
+
+class CircuitOpen(Exception):
+    """Raised instead of calling an origin whose breaker is open."""
+
+    def __init__(self, origin, retry_after):
+        super().__init__(f"{origin[0]}:{origin[1]} is unavailable")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Closed/open/half-open breaker for calls to one origin.
+
+    While closed, every call is let through and its outcome counted in
+    one-second buckets. Once the last WINDOW seconds hold at least
+    MIN_CALLS calls and FAILURE_RATE of them failed (errors, 5xx or
+    slower than SLOW_CALL), the breaker opens and calls fail fast. After
+    OPEN_SECONDS one probe call is let through (half-open): its success
+    closes the breaker, its failure opens it again.
+    """
+
+    def __init__(self, origin):
+        self.origin = origin
+        self.lock = Lock()
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.probing = False
+        self.buckets = [[0, 0, 0] for _ in range(WINDOW)]  # second, calls, failures
+
+    def check(self):
+        """Raise CircuitOpen unless a call may go ahead now."""
+        with self.lock:
+            if self.state == CLOSED:
+                return
+            now = time.monotonic()
+            if self.state == OPEN and now - self.opened_at >= OPEN_SECONDS:
+                self.state = HALF_OPEN
+                self.probing = False
+            if self.state == HALF_OPEN and not self.probing:
+                self.probing = True  # This caller is the probe
+                return
+            retry_after = max(1, int(self.opened_at + OPEN_SECONDS - now + 0.999))
+        rejected_total.inc(f"{self.origin[0]}:{self.origin[1]}")
+        raise CircuitOpen(self.origin, retry_after)
+
+    def record(self, ok, seconds=0.0):
+        """Count the outcome of a call let through by check()."""
+        ok = ok and seconds < SLOW_CALL
+        now = time.monotonic()
+        with self.lock:
+            if self.state == HALF_OPEN:
+                self.probing = False
+                if ok:
+                    self.state = CLOSED
+                    self.buckets = [[0, 0, 0] for _ in range(WINDOW)]
+                else:
+                    self._open(now)
+                return
+            if self.state == OPEN:
+                return  # A call started before the breaker opened
+
+            second = int(now)
+            bucket = self.buckets[second % WINDOW]
+            if bucket[0] != second:
+                bucket[:] = [second, 0, 0]
+            bucket[1] += 1
+            bucket[2] += not ok
+            if ok:
+                return
+            calls = failures = 0
+            for start, bucket_calls, bucket_failures in self.buckets:
+                if second - start < WINDOW:
+                    calls += bucket_calls
+                    failures += bucket_failures
+            if calls >= MIN_CALLS and failures >= calls * FAILURE_RATE:
+                self._open(now)
+
+    def _open(self, now):
+        self.state = OPEN
+        self.opened_at = now
+
+
+class Breakers:
+    """One CircuitBreaker per (host, port), created on first use.
+
+    At most MAX_ORIGINS are kept, so forward proxy traffic to ever new
+    origins bounds both memory and the proxy_circuit_state series. The
+    least recently used breaker is dropped; if its origin comes back it
+    starts closed with an empty window.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.breakers = OrderedDict()  # (host, port) -> CircuitBreaker, LRU first
+
+    def get(self, host, port):
+        origin = (host, port)
+        with self.lock:
+            breaker = self.breakers.get(origin)
+            if breaker is None:
+                breaker = self.breakers[origin] = CircuitBreaker(origin)
+                while len(self.breakers) > MAX_ORIGINS:
+                    self.breakers.popitem(last=False)
+            else:
+                self.breakers.move_to_end(origin)
+        return breaker
+
+    def states(self):
+        return {
+            (f"{host}:{port}",): _STATE_VALUES[breaker.state]
+            for (host, port), breaker in self._snapshot()
+        }
+
+    def _snapshot(self):
+        with self.lock:
+            return list(self.breakers.items())
@@ -0,0 +1,144 @@
+import gzip
+from functools import lru_cache
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ENCODING = "gzip"  # Content-Encoding cached responses are stored in
+MIN_SIZE = 256  # Bodies smaller than this are stored as they are
+MIN_SAVING = 0.1  # Stored compressed only when at least this fraction smaller
+DECODED_CACHE_SIZE = 256  # Recently decompressed bodies kept for identity clients
+COMPRESSIBLE_TYPES = (  # Content-Type prefixes worth compressing
+    b"text/",
+    b"application/json",
+    b"application/javascript",
+    b"application/xml",
+    b"image/svg+xml",
+)
+
+# Content-Encoding -> (compress, decompress); zstd and br need their modules
+CODECS = {"gzip": (lambda data: gzip.compress(data, 6, mtime=0), gzip.decompress)}
+if zstandard is not None:
+    CODECS["zstd"] = (
+        lambda data: zstandard.ZstdCompressor(level=6).compress(data),
+        lambda data: zstandard.ZstdDecompressor().decompress(data),
+    )
+if brotli is not None:
+    CODECS["br"] = (lambda data: brotli.compress(data, quality=5), brotli.decompress)
+
+
+def compress_response(response, encoding=ENCODING):
+    """Return a whole response with its body compressed for storage.
+
+    Only Content-Length framed bodies of a compressible type that are not
+    encoded already, and that shrink enough, are compressed; any other
+    response comes back unchanged.
+    """
+    head_end = response.find(b"\r\n\r\n")
+    head = response[:head_end]
+    headers = _headers(head)
+    if (
+        b"content-length" not in headers
+        or b"content-encoding" in headers
+        or b"transfer-encoding" in headers
+        or not headers.get(b"content-type", b"").lower().startswith(COMPRESSIBLE_TYPES)
+    ):
+        return response
+    body = response[head_end + 4 :]
+    if len(body) < MIN_SIZE:
+        return response
+    compressed = CODECS[encoding][0](body)
+    if len(compressed) > len(body) * (1 - MIN_SAVING):
+        return response
+
+    vary = headers.get(b"vary")
+    head = _replace_headers(
+        head,
+        {
+            b"content-length": str(len(compressed)).encode("latin-1"),
+            b"content-encoding": encoding.encode("latin-1"),
+            b"vary": vary + b", Accept-Encoding" if vary else b"Accept-Encoding",
+        },
+    )
+    return head + b"\r\n\r\n" + compressed
+
+
+def negotiate(head, body, accept_encoding):
+    """Return (head, body) of a cached response as the client may receive it.
+
+    A body in an encoding the client does not accept is decompressed and
+    its headers adjusted; anything else is passed through untouched.
+    """
+    encoding = needs_decoding(head, accept_encoding)
+    if encoding is None:
+        return head, body
+    body = _decode(encoding, bytes(body))
+    head = _replace_headers(
+        head,
+        {b"content-length": str(len(body)).encode("latin-1"), b"content-encoding": None},
+    )
+    return head, body
+
+
+def needs_decoding(head, accept_encoding):
+    """Return the encoding a client cannot accept the body in, or None."""
+    encoding = _headers(head).get(b"content-encoding", b"").decode("latin-1").strip().lower()
+    if encoding not in CODECS or accepts(accept_encoding, encoding):
+        return None
+    return encoding
+
+
+# Keyed by the compressed body, which is small and cheap to hash, so hot
+# entries are decompressed once rather than on every hit
+@lru_cache(maxsize=DECODED_CACHE_SIZE)
+def _decode(encoding, data):
+    return CODECS[encoding][1](data)
+
+
+def accepts(accept_encoding, encoding):
+    # Accept-Encoding: gzip, br;q=1.0, *;q=0 -- a q of 0 means "not this one"
+    wildcard = None
+    for item in accept_encoding.lower().split(","):
+        name, _, params = item.partition(";")
+        name = name.strip()
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if name == encoding:
+            return quality > 0
+        if name == "*":
+            wildcard = quality > 0
+    return bool(wildcard)
+
+
+def _headers(head):
+    # Lower-case header name -> value of a response head
+    headers = {}
+    for line in head.split(b"\r\n")[1:]:
+        name, _, value = line.partition(b":")
+        headers[name.strip().lower()] = value.strip()
+    return headers
+
+
+def _replace_headers(head, values):
+    # Drop the named headers and append the new values; None only removes
+    lines = head.split(b"\r\n")
+    kept = [line for line in lines[1:] if line.partition(b":")[0].strip().lower() not in values]
+    added = [
+        _title(name) + b": " + value for name, value in values.items() if value is not None
+    ]
+    return b"\r\n".join([lines[0]] + kept + added)
+
+
+def _title(name):
+    return b"-".join(part.capitalize() for part in name.split(b"-"))
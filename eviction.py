@@ -0,0 +1,177 @@
+from collections import OrderedDict
+
+WINDOW_SHARE = 0.01  # W-TinyLFU: share of entries in the admission window
+PROTECTED_SHARE = 0.8  # W-TinyLFU: share of the main area kept for reused entries
+SKETCH_DEPTH = 4  # Count-min sketch rows
+MAX_COUNT = 15  # Sketch counters saturate here (4-bit, as in TinyLFU)
+
+# A policy orders the keys of one cache shard. The shard calls access()
+# on every lookup, hit or miss, add() when a key is stored, and victim()
+# whenever it must drop an entry; victim() forgets the key it returns.
+# Callers hold the shard lock, so policies need no locking of their own.
+
+
+class LRU:
+    """Evict the least recently used key."""
+
+    def __init__(self, capacity):
+        self.order = OrderedDict()
+
+    def __len__(self):
+        return len(self.order)
+
+    def access(self, key):
+        if key in self.order:
+            self.order.move_to_end(key)
+
+    def add(self, key):
+        self.order[key] = None
+        self.order.move_to_end(key)
+
+    def victim(self):
+        return self.order.popitem(last=False)[0]
+
+    def clear(self):
+        self.order.clear()
+
+
+class Clock:
+    """Second-chance CLOCK: the hand skips keys referenced since its last pass.
+
+    Hits only set a flag instead of reordering, which is cheaper than LRU
+    and approximates it closely.
+    """
+
+    def __init__(self, capacity):
+        self.ring = OrderedDict()  # key -> referenced, in hand order
+
+    def __len__(self):
+        return len(self.ring)
+
+    def access(self, key):
+        if key in self.ring:
+            self.ring[key] = True
+
+    def add(self, key):
+        if key in self.ring:
+            self.ring[key] = True
+        else:
+            self.ring[key] = False
+
+    def victim(self):
+        while True:
+            key, referenced = self.ring.popitem(last=False)
+            if not referenced:
+                return key
+            self.ring[key] = False  # Second chance: back behind the hand
+
+    def clear(self):
+        self.ring.clear()
+
+
+class CountMinSketch:
+    """Approximate access counts of recent keys in a few small counters.
+
+    Counters saturate at MAX_COUNT and are all halved after every
+    10 * capacity increments, so the counts favour recent popularity.
+    """
+
+    def __init__(self, capacity):
+        width = 1
+        while width < max(16, capacity):
+            width *= 2
+        self.mask = width - 1
+        self.rows = [bytearray(width) for _ in range(SKETCH_DEPTH)]
+        self.sample_size = 10 * max(1, capacity)
+        self.additions = 0
+
+    def _indexes(self, key):
+        h = hash(key)
+        for i in range(SKETCH_DEPTH):
+            # Rows are indexed by different bits of a re-mixed hash
+            h = (h * 0x9E3779B1 + i) & 0xFFFFFFFFFFFF
+            yield (h >> 16) & self.mask
+
+    def increment(self, key):
+        for row, index in zip(self.rows, self._indexes(key)):
+            if row[index] < MAX_COUNT:
+                row[index] += 1
+        self.additions += 1
+        if self.additions >= self.sample_size:
+            self.additions //= 2
+            for row in self.rows:
+                row[:] = bytes(count >> 1 for count in row)
+
+    def estimate(self, key):
+        return min(row[index] for row, index in zip(self.rows, self._indexes(key)))
+
+
+class WTinyLFU:
+    """W-TinyLFU: a small LRU window in front of a frequency-filtered SLRU.
+
+    New keys enter the window. Keys pushed out of it join the probation
+    segment of the main area, and a probation key that is hit again moves
+    to the protected segment. When an entry must go, the key that most
+    recently left the window competes with the probation segment's LRU
+    key, and the one the sketch has seen less often is evicted. A one-off
+    scan therefore passes through the window and probation without
+    displacing frequently used keys.
+    """
+
+    def __init__(self, capacity):
+        capacity = max(2, capacity)
+        self.window_size = max(1, int(capacity * WINDOW_SHARE))
+        self.protected_size = max(1, int((capacity - self.window_size) * PROTECTED_SHARE))
+        self.window = OrderedDict()
+        self.probation = OrderedDict()
+        self.protected = OrderedDict()
+        self.candidate = None  # Last key moved from the window to probation
+        self.sketch = CountMinSketch(capacity)
+
+    def __len__(self):
+        return len(self.window) + len(self.probation) + len(self.protected)
+
+    def access(self, key):
+        self.sketch.increment(key)
+        if key in self.window:
+            self.window.move_to_end(key)
+        elif key in self.protected:
+            self.protected.move_to_end(key)
+        elif key in self.probation:
+            del self.probation[key]
+            self.protected[key] = None
+            if len(self.protected) > self.protected_size:
+                demoted, _ = self.protected.popitem(last=False)
+                self.probation[demoted] = None
+
+    def add(self, key):
+        if key in self.window or key in self.probation or key in self.protected:
+            return
+        self.window[key] = None
+        if len(self.window) > self.window_size:
+            candidate, _ = self.window.popitem(last=False)
+            self.probation[candidate] = None
+            self.candidate = candidate
+
+    def victim(self):
+        candidate, self.candidate = self.candidate, None
+        segment = self.probation or self.protected or self.window
+        victim = next(iter(segment))
+        if (
+            candidate is not None
+            and candidate != victim
+            and candidate in self.probation
+            and self.sketch.estimate(candidate) <= self.sketch.estimate(victim)
+        ):
+            segment, victim = self.probation, candidate
+        del segment[victim]
+        return victim
+
+    def clear(self):
+        self.window.clear()
+        self.probation.clear()
+        self.protected.clear()
+        self.candidate = None
+
+
+POLICIES = {"lru": LRU, "clock": Clock, "tinylfu": WTinyLFU}
@@ -0,0 +1,165 @@
+MAX_HEAD_SIZE = 8192  # Largest request head accepted
+MAX_BODY_SIZE = 1 << 20  # Largest request body accepted
+
+
+class BadRequest(ValueError):
+    """A request that cannot be read; answer bad_request(error) and close."""
+
+
+class Request:
+    """One parsed HTTP request.
+
+    method, target and version come from the request line; headers keeps
+    every (name, value) pair in arrival order for forwarding, and
+    header() looks one up case-insensitively. Header bytes are decoded as
+    latin-1, which maps every byte, so re-encoding the request restores
+    it exactly.
+    """
+
+    __slots__ = ("method", "target", "version", "headers", "body", "_index")
+
+    def __init__(self, method, target, version, headers, body=b"", index=None):
+        self.method = method
+        self.target = target
+        self.version = version
+        self.headers = headers
+        self.body = body
+        # Lower-case name -> value; a repeated header keeps its last value
+        if index is None:
+            index = {name.lower(): value for name, value in headers}
+        self._index = index
+
+    @property
+    def line(self):
+        return f"{self.method} {self.target} {self.version}"
+
+    def header(self, name, default=None):
+        return self._index.get(name, default)
+
+    @property
+    def content_length(self):
+        # Digits only: int() would also take "-3", "+3" or " 3"
+        value = self._index.get("content-length")
+        if not value:
+            return 0
+        if not (value.isascii() and value.isdigit()):
+            raise BadRequest("Invalid Content-Length")
+        return int(value)
+
+    def encode(self, request_line=None, headers=None):
+        # Serialize the request, optionally with another request line or
+        # header list, for forwarding
+        if headers is None:
+            headers = self.headers
+        lines = [request_line or self.line] + [f"{name}: {value}" for name, value in headers]
+        return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + self.body
+
+
+def parse_head(head):
+    """Parse a request head (bytes-like, without the blank line) into a Request.
+
+    One pass over the header lines fills both the ordered list and the
+    lookup index. A malformed request line still parses, with the missing
+    parts left empty, so callers can answer it with a proper 400 response.
+    """
+    lines = head.decode("latin-1").split("\r\n")
+    parts = lines[0].split(" ", 2)
+    if len(parts) < 3:
+        parts += [""] * (3 - len(parts))
+    headers = []
+    index = {}
+    for line in lines[1:]:
+        name, colon, value = line.partition(":")
+        if colon:
+            name = name.strip()
+            value = value.strip()
+            headers.append((name, value))
+            index[name.lower()] = value
+    return Request(parts[0], parts[1], parts[2], headers, index=index)
+
+
+class RequestParser:
+    """Incremental parser for a stream of (possibly pipelined) requests.
+
+    feed() whatever recv() returned; next_request() returns each request
+    once its head and Content-Length body are complete, or None until
+    then. Heads over max_head_size and bodies over max_body_size are
+    refused before they are buffered. The search for the end of the head resumes where the previous
+    one stopped, so a head arriving in many pieces is scanned only once.
+    """
+
+    def __init__(self, max_head_size=MAX_HEAD_SIZE, max_body_size=MAX_BODY_SIZE):
+        self.max_head_size = max_head_size
+        self.max_body_size = max_body_size
+        self.buffer = bytearray()
+        self.scanned = 0  # Bytes of buffer known not to contain the head end
+        self.pending = None  # Request whose body is still arriving
+
+    def feed(self, data):
+        self.buffer += data
+
+    def next_request(self):
+        """Return the next complete Request, or None if more data is needed.
+
+        Raises BadRequest when a head exceeds max_head_size, or when the
+        Content-Length is malformed or over max_body_size.
+        """
+        if self.pending is None:
+            end = self.buffer.find(b"\r\n\r\n", max(0, self.scanned - 3))
+            if end < 0:
+                self.scanned = len(self.buffer)
+                if self.scanned > self.max_head_size:
+                    raise BadRequest("Request header too large")
+                return None
+            if end > self.max_head_size:
+                raise BadRequest("Request header too large")
+            pending = parse_head(self.buffer[:end])
+            if pending.content_length > self.max_body_size:
+                raise BadRequest("Request body too large")
+            self.pending = pending
+            del self.buffer[: end + 4]
+            self.scanned = 0
+
+        length = self.pending.content_length
+        if len(self.buffer) < length:
+            return None
+        request, self.pending = self.pending, None
+        if length:
+            request.body = bytes(self.buffer[:length])
+            del self.buffer[:length]
+        return request
+
+    def unread(self):
+        """Hand over and forget the bytes received past the last request."""
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        self.scanned = 0
+        return data
+
+
+def bad_request(error):
+    # The 400 response for a BadRequest; the connection is closed after it
+    message = str(error).encode("latin-1")
+    return (
+        b"HTTP/1.1 400 Bad Request\r\n"
+        + f"Content-Length: {len(message)}\r\n".encode("latin-1")
+        + b"Connection: close\r\n\r\n"
+        + message
+    )
+
+
+def wants_keep_alive(request):
+    # HTTP/1.1 connections persist unless the client says otherwise,
+    # HTTP/1.0 ones only when it asks; proxies also get Proxy-Connection
+    connection = request.header("connection") or request.header("proxy-connection") or ""
+    if request.version == "HTTP/1.1":
+        return connection.lower() != "close"
+    return connection.lower() == "keep-alive"
+
+
+def page_size(target):
+    """Return the size asked for by a "/<digits>" target, or None."""
+    digits = target[1:]
+    if target[:1] == "/" and digits.isascii() and digits.isdigit():
+        return int(digits)
+    return None
@@ -0,0 +1,90 @@
+import os
+import sys
+import time
+import queue
+import random
+import atexit
+import logging
+import logging.handlers
+
+LEVEL = "INFO"  # Default level of the root logger
+ACCESS_SAMPLE = 1.0  # Fraction of requests written to the access log
+QUEUE_SIZE = 10000  # Records buffered for the writer before new ones are dropped
+FORMAT = "%(asctime)s %(process)d %(levelname)s %(name)s: %(message)s"
+
+access_log = logging.getLogger("access")
+_listener = None
+_listener_pid = None
+_access_sample = ACCESS_SAMPLE
+_settings = None  # Arguments of the last setup(), reused in forked children
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    # Never block the caller: when the writer falls behind, count and drop
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup(level=LEVEL, access_sample=ACCESS_SAMPLE, log_file=None):
+    """Send every log record through a bounded queue to one writer thread.
+
+    Request handlers only format the record and enqueue it; the terminal
+    or file write happens on the writer thread. The writer thread does not
+    survive a fork, so forked children start their own.
+    """
+    global _listener, _listener_pid, _access_sample, _settings
+    if _listener is not None and _listener_pid == os.getpid():
+        _listener.stop()
+
+    if log_file:
+        output = logging.handlers.WatchedFileHandler(log_file)
+    else:
+        output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(logging.Formatter(FORMAT))
+
+    log_queue = queue.Queue(QUEUE_SIZE)
+    root = logging.getLogger()
+    root.handlers = [_DroppingQueueHandler(log_queue)]
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(log_queue, output)
+    _listener_pid = os.getpid()
+    _listener.start()
+    _access_sample = access_sample
+    if _settings is None:
+        atexit.register(shutdown)
+        os.register_at_fork(after_in_child=lambda: setup(*_settings))
+    _settings = (level, access_sample, log_file)
+
+
+def shutdown():
+    # Flush what is still queued; os._exit in workers skips atexit, so
+    # they call this themselves
+    global _listener
+    if _listener is not None and _listener_pid == os.getpid():
+        _listener.stop()
+        _listener = None
+
+
+def access(client, request_line, status, sent, started, cache_status="-"):
+    # One line per sampled request: client, request line, status, bytes
+    # sent, latency since started (a time.monotonic() value), cache status
+    if _access_sample < 1 and random.random() >= _access_sample:
+        return
+    if access_log.isEnabledFor(logging.INFO):
+        access_log.info(
+            '%s "%s" %s %s %.1fms %s',
+            client,
+            request_line,
+            status,
+            sent,
+            (time.monotonic() - started) * 1000,
+            cache_status,
+        )
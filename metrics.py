@@ -0,0 +1,144 @@
+import bisect
+import threading
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"  # Prometheus text format
+PATH = "/__metrics"  # Where both servers expose their metrics
+
+_registry = []  # Every metric created, in creation order
+
+
+def _log_linear(low, high, steps=4):
+    # HDR-style bounds: every power of two from low up to high is split
+    # into steps linear sub-buckets, so relative error stays under 1/steps
+    bounds = []
+    base = low
+    while base < high:
+        bounds += [base * (1 + i / steps) for i in range(steps)]
+        base *= 2
+    return bounds
+
+
+LATENCY_BUCKETS = _log_linear(0.0001, 30)  # 100 us to ~30 s, within 25%
+
+
+class _Metric:
+    """Base of the metric types; values are kept per tuple of label values.
+
+    A counter or gauge given a function is read from it at scrape time
+    instead: it returns the value, or a dict of label values to values.
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name, help, labels=(), function=None):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.function = function
+        self.lock = threading.Lock()
+        self.values = {}  # label values -> value
+        _registry.append(self)
+
+    def _label_text(self, values, extra=()):
+        pairs = list(zip(self.labels, values)) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+    def samples(self):
+        # Yields (suffix, label text, value) for render()
+        if self.function is not None:
+            items = self.function()
+            items = items.items() if isinstance(items, dict) else [((), items)]
+        else:
+            with self.lock:
+                items = list(self.values.items())
+        for values, value in items:
+            yield "", self._label_text(values), value
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, value, *labels):
+        with self.lock:
+            self.values[labels] = value
+
+
+class Histogram(_Metric):
+    """Bucketed distribution of observed values, latencies by default.
+
+    Each label set keeps one count per bucket plus a sum, so observe() is
+    a binary search and two additions whatever the traffic.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+
+    def observe(self, value, *labels):
+        with self.lock:
+            state = self.values.get(labels)
+            if state is None:
+                state = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][bisect.bisect_left(self.buckets, value)] += 1
+            state[1] += value
+
+    def samples(self):
+        with self.lock:
+            items = [
+                (values, list(counts), total)
+                for values, (counts, total) in self.values.items()
+            ]
+        for values, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield "_bucket", self._label_text(values, [("le", f"{bound:g}")]), cumulative
+            cumulative += counts[-1]
+            yield "_bucket", self._label_text(values, [("le", "+Inf")]), cumulative
+            yield "_sum", self._label_text(values), total
+            yield "_count", self._label_text(values), cumulative
+
+
+def render():
+    """Return every metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in _registry:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for suffix, labels, value in metric.samples():
+            value = value if isinstance(value, int) else repr(float(value))
+            lines.append(f"{metric.name}{suffix}{labels} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def response(keep_alive):
+    # A complete HTTP response carrying render(); never cached
+    body = render().encode("utf-8")
+    return (
+        b"HTTP/1.1 200 OK\r\n"
+        + f"Content-Type: {CONTENT_TYPE}\r\n".encode("utf-8")
+        + f"Content-Length: {len(body)}\r\n".encode("utf-8")
+        + b"Cache-Control: no-store\r\n"
+        + (b"Connection: keep-alive\r\n" if keep_alive else b"Connection: close\r\n")
+        + b"\r\n"
+        + body
+    )
@@ -0,0 +1,89 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+INTERVAL = 0.01  # Seconds between stack samples
+MAX_DEPTH = 64  # Innermost frames kept per sample
+PATH = "/__profile"  # Where the proxy serves the collected stacks
+CONTENT_TYPE = "text/plain; charset=utf-8"
+
+
+class StackSampler:
+    """Wall-clock sampling profiler for every thread of this process.
+
+    A daemon thread wakes every interval seconds, takes the stack of each
+    other thread from sys._current_frames() and counts it folded to
+    "file:function;file:function;...", the collapsed format flamegraph.pl,
+    inferno and speedscope read. Threads blocked in recv() or a lock are
+    sampled too, so the profile shows where requests wait as well as where
+    they compute. Nothing is traced between samples, so the overhead is
+    one stack walk per thread per interval and none on the request path.
+    """
+
+    def __init__(self, interval=INTERVAL):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.stacks = Counter()  # folded stack -> samples
+        self.samples = 0
+        self.thread = None
+
+    def start(self):
+        # Called in each worker after forking; threads do not survive fork
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+            self.thread.start()
+
+    def _run(self):
+        own = threading.get_ident()
+        while True:
+            time.sleep(self.interval)
+            folded = [
+                _fold(frame)
+                for ident, frame in sys._current_frames().items()
+                if ident != own
+            ]
+            with self.lock:
+                self.stacks.update(folded)
+                self.samples += 1
+
+    def collapsed(self, reset=False):
+        """Return the samples so far as collapsed stacks, one per line."""
+        with self.lock:
+            stacks = self.stacks
+            if reset:
+                self.stacks = Counter()
+                self.samples = 0
+        return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+    def response(self, keep_alive, reset=False):
+        # A complete HTTP response carrying collapsed(); never cached
+        body = self.collapsed(reset).encode("utf-8")
+        return (
+            b"HTTP/1.1 200 OK\r\n"
+            + f"Content-Type: {CONTENT_TYPE}\r\n".encode("utf-8")
+            + f"Content-Length: {len(body)}\r\n".encode("utf-8")
+            + b"Cache-Control: no-store\r\n"
+            + (b"Connection: keep-alive\r\n" if keep_alive else b"Connection: close\r\n")
+            + b"\r\n"
+            + body
+        )
+
+    def dump(self, path):
+        """Write collapsed() to path, replacing it in one rename."""
+        temporary = f"{path}.tmp"
+        with open(temporary, "w", encoding="utf-8") as f:
+            f.write(self.collapsed())
+        os.replace(temporary, path)
+
+
+def _fold(frame):
+    # Outermost frame first, as flame graph tools expect
+    names = []
+    while frame is not None and len(names) < MAX_DEPTH:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    names.reverse()
+    return ";".join(names)
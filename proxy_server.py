@@ -1,9 +1,35 @@
+import os
 import socket
 import threading
 import signal
 import argparse
+import asyncio
+import time
+import logging
+import concurrent.futures
+from collections import namedtuple
 from urllib.parse import urlparse
-from cache import Cache
+from cache import Cache, Entry, FileEntry, NegativeCache, MEMORY_BYTES, DISK_BYTES, SHARDS, POLICY
+from cache import ZERO_COPY_MIN_BYTES
+import cache as cache_module
+from eviction import POLICIES
+from shared_cache import SharedCache
+from upstream_pool import ConnectionPool
+from single_flight import SingleFlight
+from response_stream import UpstreamResponse
+from request_trace import TraceWriter
+from resolver import Resolver, load_hosts, TTL, NEGATIVE_TTL
+from admission import ConnectionLimiter, RequestQueue, Overloaded
+from circuit_breaker import Breakers, CircuitOpen
+import admission
+import compression
+import profiling
+from http_parser import RequestParser, BadRequest, bad_request, parse_head, wants_keep_alive, page_size
+import http_parser
+import logs
+import metrics
+import tunnel
+import workers
 
 # Check active IP addresses on your local machine by:
 # MacOS/Linux: ifconfig
@@ -12,194 +38,1074 @@ HOST = "127.0.0.1"
 PORT = 8888  # Default port number
 WEB_SERVER_PORT = 8080
 CACHE_DIR = "./proxy_cache"
+CACHE_MEMORY_BYTES = MEMORY_BYTES  # Byte budget of the in-memory cache tier
+CACHE_DISK_BYTES = DISK_BYTES  # Byte budget of the on-disk cache tier
+CACHE_SHARDS = SHARDS  # Independently locked cache segments
+CACHE_POLICY = POLICY  # Eviction policy of the tiered cache
+SENDFILE_MIN_BYTES = ZERO_COPY_MIN_BYTES  # Disk hits this large are sent with sendfile
+BACKLOG = 128  # Pending connections queued by the kernel
+MAX_CONNECTIONS = admission.MAX_CONNECTIONS  # Client connections served at once
+MAX_CONNECTIONS_PER_CLIENT = admission.MAX_CONNECTIONS_PER_CLIENT  # Per client IP; 0 is unlimited
+MAX_QUEUE = admission.MAX_QUEUE  # Requests waiting for the web server path
+QUEUE_TARGET_DELAY = admission.TARGET_DELAY  # Queueing tolerated before shedding
+QUEUE_INTERVAL = admission.INTERVAL  # Window the queueing delay is judged over
+UPSTREAM_THREADS = 32  # Threads running the blocking cache/origin path
+POOL_MAX_IDLE = 32  # Idle keep-alive sockets kept per origin, below server.py's 50 threads
+CLIENT_IDLE_TIMEOUT = 15  # Seconds a keep-alive client may wait between requests
+MAX_REQUESTS_PER_CONNECTION = 100  # Requests served before closing a client connection
+MAX_REQUEST_SIZE = 8192  # Largest request head accepted from a client
+MAX_REQUEST_BODY = http_parser.MAX_BODY_SIZE  # Largest request body accepted from a client
+CACHED_HEAD_READ = 4096  # Bytes read to find the head of a cached response on disk
+STALE_WHILE_REVALIDATE = 0  # Seconds stale entries are served while refreshing
+CACHE_COMPRESSION = compression.ENCODING  # Encoding cached bodies are stored in, or None
+NEGATIVE_CACHE_TTL = cache_module.NEGATIVE_TTL  # Seconds 4xx/5xx answers are reused; 0 is off
+PROFILE_FILE = "proxy_profile.folded"  # SIGUSR2 writes collapsed stacks here, per process id
+TUNNEL_IDLE_TIMEOUT = tunnel.IDLE_TIMEOUT  # Seconds before an idle CONNECT tunnel closes
+DNS_TTL = TTL  # Seconds a resolved origin address is reused
+DNS_NEGATIVE_TTL = NEGATIVE_TTL  # Seconds a failed origin lookup is remembered
 
 signal.signal(signal.SIGTSTP, signal.SIG_IGN)
 
+# A body send() may be handed instead of bytes: count bytes of file from offset
+FileRange = namedtuple("FileRange", "file offset count")
 
-def proxy_server(cache_size):
-    cache = Cache(CACHE_DIR, cache_size)  # Cache initialized for every instance
+log = logging.getLogger("proxy")
+# Keep-alive sockets to the web server, shared by every client handler
+upstream_pool = ConnectionPool(POOL_MAX_IDLE)
+# Requests to the web server in progress, by cache key
+flights = SingleFlight()
+# Cache shared by all worker processes; when set, open_cache returns it
+shared_cache = None
+# Binary request trace, written when --trace-file is given
+tracer = None
+# Stack sampling profiler, running when --profile is given
+sampler = None
+# Cached name lookups and connection racing for other origins
+resolver = Resolver(DNS_TTL, DNS_NEGATIVE_TTL)
+# Admission control: connections over the caps and requests that queue
+# too long for one of the UPSTREAM_THREADS slots get a 503
+connection_limiter = ConnectionLimiter(MAX_CONNECTIONS, MAX_CONNECTIONS_PER_CLIENT)
+request_queue = RequestQueue(UPSTREAM_THREADS, MAX_QUEUE, QUEUE_TARGET_DELAY, QUEUE_INTERVAL)
+# Per-origin circuit breakers: an origin that keeps failing or answering
+# slowly is failed fast for a while instead of being connected to
+breakers = Breakers()
+# Error answers of the web server, reused briefly and never written to disk
+negative_cache = NegativeCache(NEGATIVE_CACHE_TTL)
+
+# Served at metrics.PATH; every worker process keeps its own
+requests_total = metrics.Counter(
+    "proxy_requests_total",
+    "Requests answered, by route, status and cache status",
+    ("route", "status", "cache"),
+)
+request_seconds = metrics.Histogram(
+    "proxy_request_duration_seconds",
+    "Time to answer a request for the web server, by cache status",
+    ("cache",),
+)
+# Where a request's time goes: parse, cache_lookup, lock_wait (behind
+# another request's fetch), upstream_connect, upstream_read, client_write
+stage_seconds = metrics.Histogram(
+    "proxy_stage_duration_seconds",
+    "Time each request spent in each stage of the request path",
+    ("stage",),
+)
+active_connections = metrics.Gauge(
+    "proxy_active_connections", "Client connections currently open"
+)
+metrics.Gauge(
+    "proxy_upstream_idle_connections",
+    "Idle keep-alive sockets to the web server",
+    function=upstream_pool.idle_count,
+)
+metrics.Gauge(
+    "proxy_circuit_state",
+    "Circuit breaker state per origin: 0 closed, 1 half-open, 2 open",
+    ("origin",),
+    function=breakers.states,
+)
+
+
+def proxy_server(cache_size, backlog=BACKLOG, cache_dir=CACHE_DIR, reuse_port=False):
+    cache = open_cache(cache_size, cache_dir)  # Cache initialized for every instance
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server_socket:
         try:
             server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if reuse_port:
+                server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
             server_socket.bind((HOST, PORT))
-            print(f"Proxy server is running on {HOST}:{PORT}")
+            log.info("Proxy server is running on %s:%d", HOST, PORT)
 
-            server_socket.listen(10)  # Allows up to 10 connections
+            server_socket.listen(backlog)
 
             while True:
                 try:
                     client_socket, client_address = server_socket.accept()
-                    print(f"Connection received from {client_address}")
+                    try:
+                        connection_limiter.acquire(client_address[0])
+                    except Overloaded as e:
+                        admission.reject(client_socket, e)
+                        continue
+                    # Headers and body go out as separate writes
+                    client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                    log.debug("Connection received from %s", client_address)
                     client_thread = threading.Thread(
-                        target=handle_client, args=(client_socket, cache)
+                        target=handle_client, args=(client_socket, cache, client_address)
                     )
                     client_thread.start()
                 except Exception as e:
-                    print(f"Error during client handling: {e}")
+                    log.error("Error during client handling: %s", e)
 
         except KeyboardInterrupt:
-            print("\nShutting down the proxy server.")
+            log.info("Shutting down the proxy server.")
         except Exception as e:
-            print(f"Error: {e}")
+            log.error("Error: %s", e)
+        finally:
+            cache.close()  # Persist the memory tier for the next run
+
 
+def open_cache(cache_size, cache_dir):
+    if shared_cache is not None:
+        cache = shared_cache
+    else:
+        cache = Cache(
+            cache_dir,
+            cache_size,
+            CACHE_MEMORY_BYTES,
+            CACHE_DISK_BYTES,
+            CACHE_SHARDS,
+            CACHE_POLICY,
+            SENDFILE_MIN_BYTES,
+        )
+    export_cache_metrics(cache)
+    return cache
 
-def handle_client(client_socket, cache):
+
+def export_cache_metrics(cache):
+    # Read from cache.stats() at scrape time, so lookups pay nothing extra
+    def hit_ratio():
+        stats = cache.stats()
+        lookups = stats["hits"] + stats["misses"]
+        return stats["hits"] / lookups if lookups else 0.0
+
+    metrics.Gauge(
+        "proxy_cache_entries", "Entries in the cache", function=lambda: cache.stats()["entries"]
+    )
+    metrics.Gauge(
+        "proxy_cache_bytes",
+        "Bytes held by the cache, by tier",
+        ("tier",),
+        function=lambda: {
+            ("memory",): cache.stats()["memory_bytes"],
+            ("disk",): cache.stats()["disk_bytes"],
+        },
+    )
+    metrics.Counter(
+        "proxy_cache_lookups_total",
+        "Cache lookups, by result",
+        ("result",),
+        function=lambda: {
+            ("hit",): cache.stats()["hits"],
+            ("miss",): cache.stats()["misses"],
+        },
+    )
+    metrics.Counter(
+        "proxy_cache_evictions_total",
+        "Entries evicted to stay within the cache limits",
+        function=lambda: cache.stats()["evictions"],
+    )
+    metrics.Gauge("proxy_cache_hit_ratio", "Cache hits per lookup", function=hit_ratio)
+
+
+def handle_client(client_socket, cache, client_address):
+    client = f"{client_address[0]}:{client_address[1]}"
+    client_socket.settimeout(CLIENT_IDLE_TIMEOUT)
+    parser = RequestParser(MAX_REQUEST_SIZE, MAX_REQUEST_BODY)
+    served = 0
+    active_connections.inc()
     try:
-        # Receive the request from the client
-        request = client_socket.recv(1024).decode("utf-8")
-        if not request:
-            client_socket.close()
-            return
-        print(f"Received request: \n{request}")
-
-        host_line = [
-            line
-            for line in request.splitlines()
-            if line.startswith("Host:") or line.startswith("host:")
-        ][0]
-
-        if "127.0.0.1" in host_line or "localhost" in host_line:
-            response = send_request_to_web_server(request, cache)
-            print(f"Sending response to client: \n{response}\n\n")
-            client_socket.sendall(response.encode("utf-8"))
-        else:
-            send_request_to_server(request, host_line, client_socket)
+        # Answer requests in order until the client closes, goes idle or
+        # uses up its request budget; pipelined ones wait in the parser
+        while True:
+            request, parse_seconds = read_request(client_socket, parser)
+            if request is None:
+                return
+            started = time.monotonic()
+            stage_seconds.observe(parse_seconds, "parse")
+            log.debug("Received request from %s: %s", client, request.line)
+            served += 1
+
+            host = request.header("host")
+            if host is None:
+                raise ValueError("Missing Host header")
 
+            keep_alive = wants_keep_alive(request) and served < MAX_REQUESTS_PER_CONNECTION
+            if is_admin_request(request, metrics.PATH):
+                response = metrics.response(keep_alive)
+                client_socket.sendall(response)
+                record_request(client, request, "metrics", "200", len(response), started)
+                if not keep_alive:
+                    return
+            elif sampler is not None and is_admin_request(request, profiling.PATH):
+                response = sampler.response(keep_alive, "reset" in urlparse(request.target).query)
+                client_socket.sendall(response)
+                record_request(client, request, "profile", "200", len(response), started)
+                if not keep_alive:
+                    return
+            elif "127.0.0.1" in host or "localhost" in host:
+                sent = {}
+                try:
+                    keep_alive, cache_status = request_queue.run(
+                        request_queue.join(),
+                        send_request_to_web_server,
+                        request,
+                        cache,
+                        metered(socket_sender(client_socket), sent),
+                        keep_alive,
+                        sent,
+                    )
+                except Overloaded as e:
+                    response = admission.response(e)
+                    client_socket.sendall(response)
+                    record_request(client, request, "web_server", "503", len(response), started)
+                    return
+                record_request(
+                    client,
+                    request,
+                    "web_server",
+                    sent.get("status", "-"),
+                    sent.get("bytes", 0),
+                    started,
+                    cache_status,
+                    sent.get("upstream"),
+                    sent.get("stages"),
+                )
+                if not keep_alive:
+                    return
+            else:
+                # Tunnels and external origins take over the connection
+                client_socket.settimeout(None)
+                route = "connect" if request.method == "CONNECT" else "http"
+                try:
+                    send_request_to_server(request, client_socket, parser.unread())
+                except CircuitOpen as e:
+                    response = circuit_open_response(e)
+                    client_socket.sendall(response)
+                    record_request(client, request, route, "503", len(response), started)
+                    return
+                record_request(client, request, route, "-", "-", started)
+                return
+
+    except socket.timeout:
+        pass  # Idle keep-alive connection
+    except BadRequest as e:
+        log.warning("Bad request from %s: %s", client, e)
+        client_socket.sendall(bad_request(e))
     except Exception as e:
-        print(f"Error handling client: {e}")
+        log.error("Error handling client %s: %s", client, e)
         error_response = f"HTTP/1.1 500 Internal Server Error\r\n\r\n{str(e)}"
         client_socket.sendall(error_response.encode("utf-8"))
     finally:
+        active_connections.dec()
+        connection_limiter.release(client_address[0])
         client_socket.close()
 
 
-def parse_and_validate_uri(request_line):
-    try:
-        method, relative_url, http_version = request_line.split()
+def is_admin_request(request, path):
+    # A request for path (metrics.PATH, profiling.PATH) addressed to the
+    # proxy itself
+    host = request.header("host", "")
+    return host.endswith(f":{PORT}") and urlparse(request.target).path == path
+
 
-        # Check if the URI format is valid
-        if not relative_url.startswith("/") or not relative_url[1:].isdigit():
-            return False, "400 Bad Request: Malformed or invalid URI"
+def record_request(
+    client, request, route, status, sent, started, cache_status="-", upstream=None, stages=None
+):
+    # Access log line, request metrics and trace record for one answered
+    # request; upstream is the web server's time to respond, if it was
+    # asked, and stages the seconds per stage noted by add_stage()
+    duration = time.monotonic() - started
+    logs.access(client, request.line, status, sent, started, cache_status)
+    requests_total.inc(route, status, cache_status)
+    if route == "web_server":
+        request_seconds.observe(duration, cache_status)
+    if stages:
+        for stage, seconds in stages.items():
+            stage_seconds.observe(seconds, stage)
+    if tracer is not None:
+        tracer.record(request.target, status, sent, cache_status, duration, upstream)
+
+
+def read_request(client_socket, parser):
+    # Returns the next request and the seconds spent parsing it (waiting
+    # for its bytes not included), or (None, 0) once the client closes
+    while True:
+        parse_started = time.monotonic()
+        request = parser.next_request()
+        if request is not None:
+            return request, time.monotonic() - parse_started
+        data = client_socket.recv(4096)
+        if not data:
+            return None, 0
+        parser.feed(data)
+
+
+def add_stage(timings, stage, started):
+    # Adds the seconds since started to one stage of the request whose
+    # timings dict this is; background refreshes have none
+    if timings is not None:
+        stages = timings.get("stages")
+        if stages is None:
+            stages = timings["stages"] = {}
+        stages[stage] = stages.get(stage, 0.0) + time.monotonic() - started
+
+
+def set_connection_header(head, keep_alive):
+    # The client connection is ours, so replace whatever the web server said.
+    # A body without Content-Length or chunked framing can only end at EOF.
+    # Returns (head with its blank line, keep_alive).
+    lines = head.split(b"\r\n")
+    headers = [line for line in lines[1:] if not line.lower().startswith(b"connection:")]
+    status = int(lines[0].split(b" ", 2)[1])
+    framed = status in (204, 304) or any(
+        line.lower().startswith((b"content-length:", b"transfer-encoding:"))
+        for line in headers
+    )
+    keep_alive = keep_alive and framed
+    headers.append(b"Connection: keep-alive" if keep_alive else b"Connection: close")
+    return b"\r\n".join([lines[0]] + headers) + b"\r\n\r\n", keep_alive
 
-        # Convert to int and control the size range
-        document_size = int(relative_url[1:])
-        if document_size >= 9999:
-            return False, "414 Request-URI Too Long: file size is too large"
 
-        # check the GET method
-        if method != "GET":
-            return False, "510 Not Implemented: Only GET method is supported"
+def parse_and_validate_uri(request):
+    # Check if the URI format is valid; absolute-form targets name the path too
+    document_size = page_size(urlparse(request.target).path)
+    if document_size is None or not request.version or " " in request.version:
+        return False, "400 Bad Request: Malformed or invalid URI"
 
-        # If valid, return the size
-        return True, document_size
+    # Control the size range
+    if document_size >= 9999:
+        return False, "414 Request-URI Too Long: file size is too large"
 
+    # check the GET method
+    if request.method != "GET":
+        return False, "510 Not Implemented: Only GET method is supported"
+
+    # If valid, return the size
+    return True, document_size
+
+
+def send_request_to_web_server(request, cache, send, keep_alive, timings=None):
+    # Answer a request for the local web server by calling send() with the
+    # response bytes. Returns whether the client connection may stay open,
+    # and how the cache answered: HIT, STALE, COALESCED (shared another
+    # request's fetch), REVALIDATED, MISS, NEGATIVE (a recent error answer
+    # reused), BYPASS (not cacheable) or ERROR.
+    # If this request asks the web server, timings["upstream"] is set to
+    # the seconds until its response head arrived; timings["stages"] gets
+    # the time spent per stage (see add_stage).
+    is_valid, response = parse_and_validate_uri(request)
+
+    parsed_url = urlparse(request.target)  # Get the absolute URI
+
+    if not is_valid:
+        message = response.split(":", 1)[1].strip()
+        head, keep_alive = set_connection_header(
+            f"HTTP/1.1 {response}\r\nContent-Length: {len(message)}".encode("utf-8"),
+            keep_alive,
+        )
+        send(head + message.encode("utf-8"))
+        return keep_alive, "BYPASS"
+
+    # One locked lookup, so eviction cannot slip in between check and read
+    key = parsed_url.geturl()
+    accept_encoding = request.header("accept-encoding", "")
+    lookup_started = time.monotonic()
+    cached = cache.lookup(key, as_file=True)
+    add_stage(timings, "cache_lookup", lookup_started)
+    if isinstance(cached, FileEntry):
+        with cached.file:
+            if is_fresh(cached):
+                sent_keep_alive = send_cached_file(cached, send, keep_alive, accept_encoding)
+                if sent_keep_alive is not None:
+                    return sent_keep_alive, "HIT"
+            # Stale or to be decompressed: carry on with the bytes
+            cached.file.seek(0)
+            cached = Entry(cached.file.read(), cached.stored_at, cached.meta)
+    if cached is not None:
+        if is_fresh(cached):
+            return send_cached(cached.value, send, keep_alive, accept_encoding), "HIT"
+        if is_stale_usable(cached):
+            flights.do_in_background(
+                key, lambda: fetch_and_cache(request, key, cache, None, False)
+            )
+            return send_cached(cached.value, send, keep_alive, accept_encoding), "STALE"
+
+    failed = negative_cache.lookup(key)
+    if failed is not None:
+        return send_cached(failed.value, send, keep_alive, accept_encoding), "NEGATIVE"
+
+    # Concurrent misses for one key share a single web server request. The
+    # leader streams to its own client; the others get the cached copy.
+    led = []
+
+    def lead():
+        led.append(True)
+        return fetch_and_cache(request, key, cache, send, keep_alive, timings)
+
+    try:
+        flight_started = time.monotonic()
+        response, leader_keep_alive, cache_status = flights.do(key, lead)
+        if led:
+            return leader_keep_alive, cache_status
+        add_stage(timings, "lock_wait", flight_started)
+        if response is None:
+            # The leader's answer went to the negative cache, or was not
+            # cacheable at all, in which case there is nothing to share
+            # and we fetch our own
+            failed = negative_cache.lookup(key)
+            if failed is not None:
+                return send_cached(failed.value, send, keep_alive, accept_encoding), "NEGATIVE"
+            return fetch_and_cache(request, key, cache, send, keep_alive, timings)[1:]
     except Exception as e:
-        return False, f"400 Bad Request: {str(e)}"
+        # fetch_and_cache only raises before anything was sent
+        retry_after = b""
+        if isinstance(e, CircuitOpen):
+            retry_after = f"Retry-After: {e.retry_after}\r\n".encode("utf-8")
+        else:
+            log.warning("Web server request for %s failed: %s", key, e)
+        message = b"Web server is not running"
+        send(
+            b"HTTP/1.1 404 Not Found\r\n"
+            + f"Content-Length: {len(message)}\r\n".encode("utf-8")
+            + retry_after
+            + b"Connection: close\r\n\r\n"
+            + message
+        )
+        return False, "ERROR"
+    return send_cached(response, send, keep_alive, accept_encoding), "COALESCED"
 
 
-def send_request_to_web_server(request, cache):
+def send_memory_hit(request, cache, send, keep_alive, timings=None):
+    # The part of send_request_to_web_server that never blocks: answers a
+    # fresh entry of the memory tier and returns keep_alive, or returns
+    # None having sent nothing
+    is_valid, _ = parse_and_validate_uri(request)
+    if not is_valid:
+        return None
+    lookup_started = time.monotonic()
+    cached = cache.lookup_memory(urlparse(request.target).geturl(), is_fresh)
+    add_stage(timings, "cache_lookup", lookup_started)
+    if cached is None:
+        return None
+    return send_cached(cached.value, send, keep_alive, request.header("accept-encoding", ""))
+
+
+def send_cached(response, send, keep_alive, accept_encoding=""):
+    # Headers are rewritten for this client; the body goes out as a view
+    # of the cached bytes, decompressed only for clients that cannot take
+    # the stored encoding. send is None for background refreshes.
+    if send is None:
+        return keep_alive
+    head_end = response.index(b"\r\n\r\n")
+    head, body = compression.negotiate(
+        response[:head_end], memoryview(response)[head_end + 4 :], accept_encoding
+    )
+    head, keep_alive = set_connection_header(head, keep_alive)
+    send(head)
+    send(body)
+    return keep_alive
+
+
+def send_cached_or_close(response, send, keep_alive, accept_encoding):
+    # send_cached for a flight leader: a client that went away only closes
+    # its own connection, as in relay_response, so the requests waiting on
+    # this one still get the response instead of the write error
     try:
-        request_line = request.splitlines()[0]
-        is_valid, response = parse_and_validate_uri(request_line)
-
-        # Extract and adjust the Host header
-        parsed_url = urlparse(request_line.split(" ")[1])  # Get the absolute URI
-        web_server_host = parsed_url.hostname or "127.0.0.1"
-        web_server_port = parsed_url.port or WEB_SERVER_PORT
-        relative_path = parsed_url.path or "/"
-
-        if not is_valid:
-            cache.put(parsed_url.geturl(), response.encode("utf-8"))
-            return f"HTTP/1.1 {response}\r\n\r\n{response.split(':', 1)[1].strip()}"
-
-        # Inside the send_request_to_web_server function, in the Conditional GET check
-        if cache.exists(parsed_url.geturl()):
-            cached_response = cache.get(parsed_url.geturl())
-            cached_response_decoded = cached_response.decode("utf-8")  # Decode the cached response
-            if int(parsed_url.geturl().lstrip('/')) % 2 == 1:  # Odd-length files assumed unmodified
-                print("Conditional GET: Using cached response (unmodified).")
-                return cached_response_decoded  # Return the decoded cached response
-            else:
-                print("Conditional GET: Cached response invalidated (modified).")
-
-        # Reconstruct the request with the modified Host header
-        modified_request_lines = []
-        for line in request.splitlines():
-            if line.lower().startswith("host:"):
-                modified_request_lines.append(
-                    f"Host: {web_server_host}:{web_server_port}"
-                )
-            elif line == request_line:
-                modified_request_lines.append(
-                    f"{request_line.split(' ')[0]} {relative_path} {request_line.split(' ')[2]}"
-                )
-            else:
-                modified_request_lines.append(line)
-        modified_request = "\r\n".join(modified_request_lines) + "\r\n\r\n"
+        return send_cached(response, send, keep_alive, accept_encoding)
+    except OSError:
+        return False
+
 
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server_socket:
-            server_socket.connect(("127.0.0.1", WEB_SERVER_PORT))
-            server_socket.sendall(modified_request.encode("utf-8"))
-            response = server_socket.recv(1024).decode("utf-8")
+def send_cached_file(entry, send, keep_alive, accept_encoding):
+    # send_cached for a FileEntry: only the head is read into memory, and
+    # the body goes to send() as a FileRange. Returns None, having sent
+    # nothing, when the body would have to be decompressed for this client.
+    head = os.pread(entry.file.fileno(), CACHED_HEAD_READ, 0)
+    head_end = head.find(b"\r\n\r\n")
+    if head_end < 0 or compression.needs_decoding(head[:head_end], accept_encoding):
+        return None
+    head, keep_alive = set_connection_header(head[:head_end], keep_alive)
+    send(head)
+    send(FileRange(entry.file, head_end + 4, entry.size - head_end - 4))
+    return keep_alive
 
-            # Cache the response
-            cache.put(parsed_url.geturl(), response.encode("utf-8"))
 
+def fetch_and_cache(request, key, cache, send, keep_alive, timings=None):
+    # Returns (cacheable response bytes or None, keep_alive, cache status).
+    # Raises only before the first byte reaches the client.
+    # The flight we waited behind may have just refreshed the entry
+    lookup_started = time.monotonic()
+    cached = cache.lookup(key)
+    add_stage(timings, "cache_lookup", lookup_started)
+    accept_encoding = request.header("accept-encoding", "")
+    conditional_headers = []
+    if cached is not None:
+        if is_fresh(cached):
+            keep_alive = send_cached_or_close(cached.value, send, keep_alive, accept_encoding)
+            return cached.value, keep_alive, "HIT"
+        # Stale: ask the web server whether our copy is still current
+        if "etag" in cached.meta:
+            conditional_headers.append(("If-None-Match", cached.meta["etag"]))
+        if "last_modified" in cached.meta:
+            conditional_headers.append(("If-Modified-Since", cached.meta["last_modified"]))
+
+    modified_request = build_web_server_request(request, conditional_headers)
+    breaker = breakers.get(HOST, WEB_SERVER_PORT)
+    breaker.check()
+    upstream_started = time.monotonic()
+    try:
+        response = open_web_server_response(modified_request, timings)
+    except Exception:
+        breaker.record(False)
+        raise
+    upstream_seconds = time.monotonic() - upstream_started
+    breaker.record(response.status < 500, upstream_seconds)
+    if timings is not None:
+        timings["upstream"] = upstream_seconds
+
+    if cached is not None and response.status == 304:
+        finish_web_server_response(response)
+        meta = cache_meta(response.headers)
+        if meta is not None:
+            # Restart the freshness clock, keeping validators the 304 left out
+            cache.put(key, cached.value, {**cached.meta, **meta})
+        keep_alive = send_cached_or_close(cached.value, send, keep_alive, accept_encoding)
+        return cached.value, keep_alive, "REVALIDATED"
+
+    meta = cache_meta(response.headers)
+    if response.status >= 400 and meta is not None and NEGATIVE_CACHE_TTL > 0:
+        # Kept out of the main cache, so an error storm neither evicts good
+        # entries nor writes to disk
+        _, keep_alive = relay_response(
+            response, key, negative_cache, meta, send, keep_alive, timings
+        )
+        return None, keep_alive, "BYPASS"
+    if response.status != 200:
+        meta = None
+    value, keep_alive = relay_response(response, key, cache, meta, send, keep_alive, timings)
+    return value, keep_alive, "MISS" if meta is not None else "BYPASS"
+
+
+def relay_response(response, key, cache, meta, send, keep_alive, timings=None):
+    # Forward the body in fixed-size pieces as it arrives, teeing it into
+    # the cache when meta says it may be stored
+    pieces = [response.head, b"\r\n\r\n"] if meta is not None else None
+    client_open = send is not None
+    if client_open:
+        head, keep_alive = set_connection_header(response.head, keep_alive)
+        try:
+            send(head)
+        except OSError:
+            client_open = False
+
+    try:
+        body = response.body()
+        while True:
+            read_started = time.monotonic()
+            piece = next(body, None)
+            add_stage(timings, "upstream_read", read_started)
+            if piece is None:
+                break
+            if pieces is not None:
+                pieces.append(piece)
+            if client_open:
+                try:
+                    send(piece)
+                except OSError:
+                    # Finish reading anyway so the cache and the requests
+                    # waiting on this one still get the response
+                    client_open = False
+            if not client_open and pieces is None:
+                break
+    except (OSError, ValueError):
+        return None, False  # Truncated; the client sees the short body
+    finally:
+        finish_web_server_response(response)
+
+    if send is not None and not client_open:
+        keep_alive = False
+    if pieces is None:
+        return None, keep_alive
+    value = b"".join(pieces)
+    if CACHE_COMPRESSION:
+        value = compression.compress_response(value, CACHE_COMPRESSION)
+    cache.put(key, value, meta)
+    return value, keep_alive
+
+
+def build_web_server_request(request, extra_headers):
+    parsed_url = urlparse(request.target)
+    web_server_host = parsed_url.hostname or "127.0.0.1"
+    web_server_port = parsed_url.port or WEB_SERVER_PORT
+    relative_path = parsed_url.path or "/"
+
+    # Rebuild the request with the modified Host header
+    headers = []
+    for name, value in request.headers:
+        lower_name = name.lower()
+        if lower_name == "host":
+            headers.append(("Host", f"{web_server_host}:{web_server_port}"))
+        elif lower_name in ("connection", "proxy-connection"):
+            continue  # Hop-by-hop, the upstream connection is ours to manage
+        elif lower_name in ("if-none-match", "if-modified-since"):
+            continue  # Validators come from our cached copy, not the client
+        else:
+            headers.append((name, value))
+    headers += extra_headers
+    headers.append(("Connection", "keep-alive"))
+    return request.encode(f"{request.method} {relative_path} {request.version}", headers)
+
+
+def open_web_server_response(request, timings=None):
+    # Send the request and read the response head. A pooled socket may have
+    # been closed by the server since its health check; only then is a
+    # retry on a fresh connection safe.
+    while True:
+        connect_started = time.monotonic()
+        server_socket, reused = upstream_pool.acquire(HOST, WEB_SERVER_PORT)
+        add_stage(timings, "upstream_connect", connect_started)
+        try:
+            # Sending the request counts as reading: both wait on the server
+            read_started = time.monotonic()
+            server_socket.sendall(request)
+            response = UpstreamResponse(server_socket)
+            add_stage(timings, "upstream_read", read_started)
             return response
-    except Exception as e:
-        return "HTTP/1.1 404 Not Found\r\n\r\nWeb server is not running"
+        except (OSError, ValueError):
+            server_socket.close()
+            if reused:
+                continue
+            raise
+
+
+def finish_web_server_response(response):
+    if response.framing == "none":
+        response.complete = True
+    if response.reusable:
+        upstream_pool.release(HOST, WEB_SERVER_PORT, response.sock)
+    else:
+        response.sock.close()
 
 
-def send_request_to_server(request, host_line, client_socket):
+def cache_meta(headers):
+    # Freshness lifetime and validators kept with a cached response,
+    # or None when Cache-Control forbids storing it
+    directives = [
+        directive.strip().lower()
+        for directive in headers.get("cache-control", "").split(",")
+    ]
+    if "no-store" in directives or "private" in directives:
+        return None
+
+    meta = {"max_age": 0}
+    for directive in directives:
+        if directive.startswith("max-age=") and directive[8:].isdigit():
+            meta["max_age"] = int(directive[8:])
+        elif directive.startswith("stale-while-revalidate=") and directive[23:].isdigit():
+            meta["stale_while_revalidate"] = int(directive[23:])
+    if "no-cache" in directives:
+        meta["max_age"] = 0
+        meta.pop("stale_while_revalidate", None)
+    if "etag" in headers:
+        meta["etag"] = headers["etag"]
+    if "last-modified" in headers:
+        meta["last_modified"] = headers["last-modified"]
+    return meta
+
+
+def is_fresh(entry):
+    return time.time() - entry.stored_at < entry.meta.get("max_age", 0)
+
+
+def is_stale_usable(entry):
+    # Past max-age but inside the stale-while-revalidate window, either the
+    # one the web server sent or the proxy-wide default
+    window = entry.meta.get("stale_while_revalidate", STALE_WHILE_REVALIDATE)
+    age = time.time() - entry.stored_at
+    return age < entry.meta.get("max_age", 0) + window
+
+
+def connect_to_origin(host_name, port):
+    # Connect through the origin's circuit breaker; while it is open this
+    # raises CircuitOpen without touching the network
+    breaker = breakers.get(host_name, port)
+    breaker.check()
+    started = time.monotonic()
+    try:
+        server_socket = resolver.create_connection(host_name, port)
+    except OSError:
+        breaker.record(False)
+        raise
+    breaker.record(True, time.monotonic() - started)
+    return server_socket
+
+
+def circuit_open_response(e):
+    message = str(e).encode("utf-8")
+    return (
+        b"HTTP/1.1 503 Service Unavailable\r\n"
+        + f"Content-Length: {len(message)}\r\n".encode("utf-8")
+        + f"Retry-After: {e.retry_after}\r\n".encode("utf-8")
+        + b"Connection: close\r\n\r\n"
+        + message
+    )
+
+
+def send_request_to_server(request, client_socket, pending=b""):
     # If HTTPS request get, then connect to the server
     # If HTTP request get, then send the request to directly the server
-    host_name = host_line.split(":")[1].strip()
-    request_line = request.splitlines()[0]
+    # pending holds bytes the client sent after this request
+    host_name, port, forwarded = external_target(request)
 
-    if request_line.startswith("CONNECT"):  # HTTPS request
-        port = int(host_line.split(":")[2].strip())
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server_socket:
-            server_socket.connect((host_name, port))
+    if request.method == "CONNECT":  # HTTPS request
+        with connect_to_origin(host_name, port) as server_socket:
             client_socket.sendall(b"HTTP/1.1 200 Connection Established\r\n\r\n")
+            if pending:
+                server_socket.sendall(pending)
 
             # Relay data between client and server
-            client_socket.setblocking(False)
-            server_socket.setblocking(False)
-
+            tunnel.relay(client_socket, server_socket, TUNNEL_IDLE_TIMEOUT)
+    else:  # HTTP request
+        with connect_to_origin(host_name, port) as server_socket:
+            server_socket.sendall(forwarded + pending)
             while True:
+                data = server_socket.recv(4096)
+                if not data:
+                    break
+                client_socket.sendall(data)
+
+
+def external_target(request):
+    # Returns (host, port, bytes to send first) for a request to another
+    # origin. A tunnel sends nothing itself; it carries the client's bytes.
+    if request.method == "CONNECT":
+        host_name, _, port = request.target.rpartition(":")
+        return host_name, int(port), b""
+
+    parsed_url = urlparse(request.target)
+    host_name = parsed_url.hostname or request.header("host", "").split(":")[0]
+    path = parsed_url.path or "/"
+    if parsed_url.query:
+        path += "?" + parsed_url.query
+    port = parsed_url.port or 80  # Default HTTP port
+    return host_name, port, request.encode(f"{request.method} {path} {request.version}")
+
+
+def async_proxy_server(cache_size, backlog=BACKLOG, cache_dir=CACHE_DIR, reuse_port=False):
+    try:
+        asyncio.run(serve_async(cache_size, backlog, cache_dir, reuse_port))
+    except KeyboardInterrupt:
+        log.info("Shutting down the proxy server.")
+
+
+async def serve_async(cache_size, backlog, cache_dir, reuse_port):
+    cache = open_cache(cache_size, cache_dir)
+    # The cache and origin path is blocking and shared with the threaded
+    # engine, so it runs on a small bounded pool instead of a thread per client
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=UPSTREAM_THREADS)
+
+    async def on_connect(reader, writer):
+        ip = writer.get_extra_info("peername")[0]
+        try:
+            connection_limiter.acquire(ip)
+        except Overloaded as e:
+            writer.write(admission.response(e))
+            writer.close()
+            return
+        active_connections.inc()
+        try:
+            await handle_client_async(reader, writer, cache, executor)
+        finally:
+            active_connections.dec()
+            connection_limiter.release(ip)
+
+    server = await asyncio.start_server(
+        on_connect,
+        HOST,
+        PORT,
+        backlog=backlog,
+        limit=MAX_REQUEST_SIZE,  # readuntil() refuses longer request heads
+        reuse_address=True,
+        reuse_port=reuse_port,
+    )
+    log.info("Proxy server (asyncio) is running on %s:%d", HOST, PORT)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        executor.shutdown(wait=False)
+        cache.close()  # Persist the memory tier for the next run
+
+
+class IdleTimer:
+    """Aborts a connection once it has been idle for timeout seconds.
+
+    One timer per connection, re-armed only when it fires, replaces a
+    wait_for() task and timer per read. Call touch() on activity; while
+    paused (a request is being answered) the connection never times out.
+    """
+
+    def __init__(self, transport, timeout):
+        self.loop = asyncio.get_running_loop()
+        self.transport = transport
+        self.timeout = timeout
+        self.paused = False
+        self.last_active = self.loop.time()
+        self.handle = self.loop.call_later(timeout, self._check)
+
+    def touch(self):
+        self.last_active = self.loop.time()
+
+    def _check(self):
+        if self.paused:
+            # Long answers and tunnels stay paused for minutes; look again
+            # a whole timeout later rather than spinning
+            self.handle = self.loop.call_later(max(self.timeout, 0.1), self._check)
+            return
+        idle = self.loop.time() - self.last_active
+        if idle >= self.timeout:
+            self.transport.abort()  # Pending reads see EOF
+            return
+        self.handle = self.loop.call_later(self.timeout - idle, self._check)
+
+    def cancel(self):
+        self.handle.cancel()
+
+
+async def handle_client_async(reader, writer, cache, executor):
+    loop = asyncio.get_running_loop()
+    client = "%s:%d" % writer.get_extra_info("peername")[:2]
+    served = 0
+    idle = IdleTimer(writer.transport, CLIENT_IDLE_TIMEOUT)
+    try:
+        while True:
+            try:
+                idle.paused = False
+                idle.touch()
                 try:
-                    data = client_socket.recv(4096)
-                    if data:
-                        server_socket.sendall(data)
-                        print(
-                            f"Sending request for {host_name} to server: \n{data}\n\n"
-                        )
-                except BlockingIOError:
-                    pass
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except asyncio.LimitOverrunError:
+                    raise BadRequest("Request header too large") from None
+                parse_started = time.monotonic()
+                request = parse_head(head[:-4])
+                parse_seconds = time.monotonic() - parse_started
+                if request.content_length > MAX_REQUEST_BODY:
+                    raise BadRequest("Request body too large")
+                request.body = await reader.readexactly(request.content_length)
+                idle.paused = True
+            except (asyncio.IncompleteReadError, ConnectionError):
+                return  # Client closed or stayed idle
+            started = time.monotonic()
+            stage_seconds.observe(parse_seconds, "parse")
+            log.debug("Received request from %s: %s", client, request.line)
+            served += 1
+
+            host = request.header("host")
+            if host is None:
+                raise ValueError("Missing Host header")
 
+            keep_alive = wants_keep_alive(request) and served < MAX_REQUESTS_PER_CONNECTION
+            if is_admin_request(request, metrics.PATH):
+                response = metrics.response(keep_alive)
+                writer.write(response)
+                await writer.drain()
+                record_request(client, request, "metrics", "200", len(response), started)
+                if not keep_alive:
+                    return
+            elif sampler is not None and is_admin_request(request, profiling.PATH):
+                response = sampler.response(keep_alive, "reset" in urlparse(request.target).query)
+                writer.write(response)
+                await writer.drain()
+                record_request(client, request, "profile", "200", len(response), started)
+                if not keep_alive:
+                    return
+            elif "127.0.0.1" in host or "localhost" in host:
+                sent = {}
+                # Fresh memory hits are answered right here, head and body
+                # in one write; only misses, disk reads and revalidations
+                # need a thread
+                pieces = []
+                hit_keep_alive = send_memory_hit(
+                    request, cache, metered(pieces.append, sent), keep_alive, sent
+                )
                 try:
-                    data = server_socket.recv(4096)
-                    if data:
-                        client_socket.sendall(data)
-                        print(
-                            f"Sending response for {host_name} to client: \n{data}\n\n"
+                    if hit_keep_alive is not None:
+                        keep_alive, cache_status = hit_keep_alive, "HIT"
+                        writer.write(b"".join(pieces))
+                        await writer.drain()
+                    else:
+                        # Joined here, so time waiting for an executor thread counts
+                        keep_alive, cache_status = await loop.run_in_executor(
+                            executor,
+                            request_queue.run,
+                            request_queue.join(),
+                            send_request_to_web_server,
+                            request,
+                            cache,
+                            metered(threadsafe_sender(writer, loop), sent),
+                            keep_alive,
+                            sent,
                         )
-                except BlockingIOError:
-                    pass
-    else:  # HTTP request
-        # Extract the host and port from the request
-        port = 80  # Default HTTP port
-        request = request.replace("http://", "", 1).replace(host_name, "", 1)
+                except Overloaded as e:
+                    response = admission.response(e)
+                    writer.write(response)
+                    await writer.drain()
+                    record_request(client, request, "web_server", "503", len(response), started)
+                    return
+                record_request(
+                    client,
+                    request,
+                    "web_server",
+                    sent.get("status", "-"),
+                    sent.get("bytes", 0),
+                    started,
+                    cache_status,
+                    sent.get("upstream"),
+                    sent.get("stages"),
+                )
+                if not keep_alive:
+                    return
+            else:
+                route = "connect" if request.method == "CONNECT" else "http"
+                try:
+                    await send_request_to_server_async(request, reader, writer)
+                except CircuitOpen as e:
+                    response = circuit_open_response(e)
+                    writer.write(response)
+                    await writer.drain()
+                    record_request(client, request, route, "503", len(response), started)
+                    return
+                record_request(client, request, route, "-", "-", started)
+                return
 
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server_socket:
-            server_socket.connect((host_name, port))
-            server_socket.sendall(request.encode("utf-8"))
-            while True:
-                data = server_socket.recv(4096)
-                if not data:
+    except BadRequest as e:
+        log.warning("Bad request from %s: %s", client, e)
+        writer.write(bad_request(e))
+    except Exception as e:
+        log.error("Error handling client %s: %s", client, e)
+        error_response = f"HTTP/1.1 500 Internal Server Error\r\n\r\n{str(e)}"
+        writer.write(error_response.encode("utf-8"))
+    finally:
+        idle.cancel()
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except OSError:
+            pass
+
+
+def socket_sender(client_socket):
+    # sendall() that sends a FileRange with socket.sendfile, so the kernel
+    # copies it from the page cache without it passing through Python
+    def send(data):
+        if isinstance(data, FileRange):
+            client_socket.sendfile(data.file, data.offset, data.count)
+        else:
+            client_socket.sendall(data)
+
+    return send
+
+
+def threadsafe_sender(writer, loop):
+    # A blocking send() for executor threads: each piece is written on the
+    # event loop and waits for drain, which keeps buffering bounded. A
+    # FileRange is read here, off the loop, a piece at a time.
+    async def write(data):
+        writer.write(data)
+        await writer.drain()
+
+    def send(data):
+        if isinstance(data, FileRange):
+            offset, end = data.offset, data.offset + data.count
+            while offset < end:
+                piece = os.pread(data.file.fileno(), min(65536, end - offset), offset)
+                if not piece:
                     break
-                client_socket.sendall(data)
-                print(f"Sending response for {host_name} to client: \n{data}\n\n")
+                asyncio.run_coroutine_threadsafe(write(piece), loop).result()
+                offset += len(piece)
+            return
+        asyncio.run_coroutine_threadsafe(write(data), loop).result()
+
+    return send
+
+
+def metered(send, sent):
+    # Wraps send() to note the response status, the bytes sent and the
+    # client_write stage in the sent dict, for the access log and metrics
+    def metered_send(data):
+        if "status" not in sent:
+            sent["status"] = bytes(data[9:12]).decode("latin-1")
+        write_started = time.monotonic()
+        send(data)
+        add_stage(sent, "client_write", write_started)
+        size = data.count if isinstance(data, FileRange) else len(data)
+        sent["bytes"] = sent.get("bytes", 0) + size
+
+    return metered_send
+
+
+async def send_request_to_server_async(request, reader, writer):
+    host_name, port, forwarded = external_target(request)
+    # Lookup and connection racing block, so they run off the event loop
+    server_socket = await asyncio.get_running_loop().run_in_executor(
+        None, connect_to_origin, host_name, port
+    )
+    server_reader, server_writer = await asyncio.open_connection(sock=server_socket)
+    try:
+        if request.method == "CONNECT":  # HTTPS request
+            writer.write(b"HTTP/1.1 200 Connection Established\r\n\r\n")
+            await writer.drain()
+            # Loop time of the last data in either direction, shared so a
+            # tunnel busy one way is not closed as idle by the other
+            activity = [asyncio.get_running_loop().time()]
+            await asyncio.gather(
+                relay_stream(reader, server_writer, activity),
+                relay_stream(server_reader, writer, activity),
+            )
+        else:  # HTTP request
+            server_writer.write(forwarded)
+            await server_writer.drain()
+            await relay_stream(server_reader, writer)
+    finally:
+        server_writer.close()
+
+
+async def relay_stream(reader, writer, activity=None):
+    # Copy until EOF, then pass the half-close on so the peer sees it too.
+    # With activity, give up once neither direction has moved data for
+    # TUNNEL_IDLE_TIMEOUT seconds, as tunnel.relay() does for the threads
+    loop = asyncio.get_running_loop()
+    while True:
+        if activity is None:
+            data = await reader.read(4096)
+        else:
+            remaining = activity[0] + TUNNEL_IDLE_TIMEOUT - loop.time()
+            try:
+                data = await asyncio.wait_for(reader.read(4096), remaining)
+            except asyncio.TimeoutError:
+                if loop.time() - activity[0] < TUNNEL_IDLE_TIMEOUT:
+                    continue  # The other direction moved data meanwhile
+                return  # Idle tunnel: the caller closes both sides
+            activity[0] = loop.time()
+        if not data:
+            break
+        writer.write(data)
+        await writer.drain()
+    if writer.can_write_eof():
+        try:
+            writer.write_eof()
+        except OSError:
+            pass
 
 
 if __name__ == "__main__":
@@ -209,6 +1115,273 @@ if __name__ == "__main__":
         type=int,
         help="Maximum number of entries in the cache (required)",
     )
+    parser.add_argument(
+        "--engine",
+        choices=["threaded", "asyncio"],
+        default="threaded",
+        help="Connection handling engine (default: threaded)",
+    )
+    parser.add_argument(
+        "--backlog",
+        type=int,
+        default=BACKLOG,
+        help=f"Listen backlog for pending connections (default: {BACKLOG})",
+    )
+    parser.add_argument(
+        "--max-connections",
+        type=int,
+        default=MAX_CONNECTIONS,
+        help=f"Client connections served at once; more get a 503 (default: {MAX_CONNECTIONS})",
+    )
+    parser.add_argument(
+        "--max-connections-per-client",
+        type=int,
+        default=MAX_CONNECTIONS_PER_CLIENT,
+        help="Connections one client IP may hold at once; more get a 503 (default: 0, unlimited)",
+    )
+    parser.add_argument(
+        "--max-queue",
+        type=int,
+        default=MAX_QUEUE,
+        help=f"Requests that may wait for the web server path (default: {MAX_QUEUE})",
+    )
+    parser.add_argument(
+        "--queue-target-delay",
+        type=float,
+        default=QUEUE_TARGET_DELAY,
+        help="Seconds of queueing tolerated once a standing queue forms; "
+        f"requests waiting longer get a 503 (default: {QUEUE_TARGET_DELAY})",
+    )
+    parser.add_argument(
+        "--queue-interval",
+        type=float,
+        default=QUEUE_INTERVAL,
+        help=f"Seconds over which queueing delay is judged (default: {QUEUE_INTERVAL})",
+    )
+    parser.add_argument(
+        "--tunnel-idle-timeout",
+        type=float,
+        default=TUNNEL_IDLE_TIMEOUT,
+        help=f"Seconds before an idle CONNECT tunnel is closed (default: {TUNNEL_IDLE_TIMEOUT})",
+    )
+    parser.add_argument(
+        "--client-idle-timeout",
+        type=float,
+        default=CLIENT_IDLE_TIMEOUT,
+        help=f"Seconds a keep-alive client may stay idle (default: {CLIENT_IDLE_TIMEOUT})",
+    )
+    parser.add_argument(
+        "--max-requests-per-connection",
+        type=int,
+        default=MAX_REQUESTS_PER_CONNECTION,
+        help=f"Requests served on one client connection (default: {MAX_REQUESTS_PER_CONNECTION})",
+    )
+    parser.add_argument(
+        "--negative-cache-ttl",
+        type=float,
+        default=NEGATIVE_CACHE_TTL,
+        help="Seconds a 4xx/5xx answer of the web server is reused, kept in "
+        f"memory only (default: {NEGATIVE_CACHE_TTL}, 0 is off)",
+    )
+    parser.add_argument(
+        "--cache-memory-mb",
+        type=float,
+        default=CACHE_MEMORY_BYTES / 2**20,
+        help=f"Memory budget of the cache in MiB (default: {CACHE_MEMORY_BYTES // 2**20})",
+    )
+    parser.add_argument(
+        "--cache-disk-mb",
+        type=float,
+        default=CACHE_DISK_BYTES / 2**20,
+        help=f"Disk budget of the cache in MiB (default: {CACHE_DISK_BYTES // 2**20})",
+    )
+    parser.add_argument(
+        "--cache-shards",
+        type=int,
+        default=CACHE_SHARDS,
+        help=f"Independently locked cache segments (default: {CACHE_SHARDS})",
+    )
+    parser.add_argument(
+        "--cache-policy",
+        choices=list(POLICIES),
+        default=CACHE_POLICY,
+        help="Eviction policy of the tiered cache; tinylfu resists scans "
+        f"(default: {CACHE_POLICY})",
+    )
+    parser.add_argument(
+        "--sendfile-min-bytes",
+        type=int,
+        default=SENDFILE_MIN_BYTES,
+        help="Disk cache hits of at least this many bytes are sent from the "
+        f"file without being read into memory (default: {SENDFILE_MIN_BYTES})",
+    )
+    parser.add_argument(
+        "--stale-while-revalidate",
+        type=float,
+        default=STALE_WHILE_REVALIDATE,
+        help="Seconds past max-age a stale entry is served while it is "
+        f"refreshed in the background (default: {STALE_WHILE_REVALIDATE}, off)",
+    )
+    parser.add_argument(
+        "--cache-compression",
+        choices=list(compression.CODECS) + ["none"],
+        default=CACHE_COMPRESSION,
+        help="Content-Encoding cached text bodies are stored in; clients that "
+        f"accept it get it as is, others a decompressed copy (default: {CACHE_COMPRESSION})",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Processes sharing the port through SO_REUSEPORT (default: 1)",
+    )
+    parser.add_argument(
+        "--cache-backend",
+        choices=["tiered", "shared"],
+        help="tiered: per-process memory and disk cache; shared: one "
+        "shared-memory cache of --cache-memory-mb for all workers "
+        "(default: shared with --workers > 1, tiered otherwise)",
+    )
+    parser.add_argument(
+        "--dns-ttl",
+        type=float,
+        default=DNS_TTL,
+        help=f"Seconds a resolved origin address is reused (default: {DNS_TTL})",
+    )
+    parser.add_argument(
+        "--dns-negative-ttl",
+        type=float,
+        default=DNS_NEGATIVE_TTL,
+        help=f"Seconds a failed lookup is remembered (default: {DNS_NEGATIVE_TTL})",
+    )
+    parser.add_argument(
+        "--hosts-file",
+        help="/etc/hosts-style file of addresses used instead of DNS",
+    )
+    parser.add_argument(
+        "--dns-override",
+        action="append",
+        default=[],
+        metavar="NAME=ADDRESS",
+        help="Resolve NAME to ADDRESS without DNS; may be repeated",
+    )
+    parser.add_argument(
+        "--trace-file",
+        help="Append a binary record of every request (time, key, size, cache "
+        "status, upstream latency) to this file, for tests/trace_replay.py",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Sample every thread's stack; GET /__profile returns the collapsed "
+        "stacks and SIGUSR2 writes them to --profile-file",
+    )
+    parser.add_argument(
+        "--profile-interval",
+        type=float,
+        default=profiling.INTERVAL,
+        help=f"Seconds between stack samples (default: {profiling.INTERVAL})",
+    )
+    parser.add_argument(
+        "--profile-file",
+        default=PROFILE_FILE,
+        help="Where SIGUSR2 writes the collapsed stacks; the process id is "
+        f"appended, so each worker writes its own (default: {PROFILE_FILE})",
+    )
+    parser.add_argument(
+        "--log-level",
+        choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+        default=logs.LEVEL,
+        help=f"Lowest level logged; INFO includes the access log (default: {logs.LEVEL})",
+    )
+    parser.add_argument(
+        "--access-log-sample",
+        type=float,
+        default=logs.ACCESS_SAMPLE,
+        help=f"Fraction of requests written to the access log (default: {logs.ACCESS_SAMPLE})",
+    )
+    parser.add_argument(
+        "--log-file",
+        help="Write the log to this file instead of standard output",
+    )
     args = parser.parse_args()
+    logs.setup(args.log_level, args.access_log_sample, args.log_file)
+    CACHE_MEMORY_BYTES = int(args.cache_memory_mb * 2**20)
+    CACHE_DISK_BYTES = int(args.cache_disk_mb * 2**20)
+    CACHE_SHARDS = args.cache_shards
+    CACHE_POLICY = args.cache_policy
+    SENDFILE_MIN_BYTES = args.sendfile_min_bytes
+    TUNNEL_IDLE_TIMEOUT = args.tunnel_idle_timeout
+    CLIENT_IDLE_TIMEOUT = args.client_idle_timeout
+    MAX_REQUESTS_PER_CONNECTION = args.max_requests_per_connection
+    STALE_WHILE_REVALIDATE = args.stale_while_revalidate
+    CACHE_COMPRESSION = None if args.cache_compression == "none" else args.cache_compression
+    NEGATIVE_CACHE_TTL = args.negative_cache_ttl
+    negative_cache = NegativeCache(NEGATIVE_CACHE_TTL)
+    overrides = load_hosts(args.hosts_file) if args.hosts_file else {}
+    for override in args.dns_override:
+        name, _, address = override.partition("=")
+        overrides.setdefault(name, []).append(address)
+    resolver = Resolver(args.dns_ttl, args.dns_negative_ttl, overrides=overrides)
+    connection_limiter = ConnectionLimiter(args.max_connections, args.max_connections_per_client)
+    request_queue = RequestQueue(
+        UPSTREAM_THREADS, args.max_queue, args.queue_target_delay, args.queue_interval
+    )
+
+    def serve(cache_size, cache_dir, reuse_port):
+        if sampler is not None:
+            sampler.start()
+        if args.engine == "asyncio":
+            async_proxy_server(
+                cache_size, args.backlog, cache_dir, reuse_port
+            )
+        else:
+            proxy_server(cache_size, args.backlog, cache_dir, reuse_port)
+
+    if args.profile:
+        sampler = profiling.StackSampler(args.profile_interval)
+        signal.signal(
+            signal.SIGUSR2,
+            lambda signum, frame: sampler.dump(f"{args.profile_file}.{os.getpid()}"),
+        )
+
+    if args.trace_file:
+        # Opened before forking; workers append to the same file
+        tracer = TraceWriter(args.trace_file)
+        workers.at_exit(tracer.flush)
+
+    backend = args.cache_backend or ("shared" if args.workers > 1 else "tiered")
+    if backend == "shared":
+        # Created before forking so every worker maps the same region
+        shared_cache = SharedCache(CACHE_MEMORY_BYTES, max_size=args.cache_size)
+        log.info(
+            "Shared cache: %d slots of %d bytes",
+            shared_cache.slot_count,
+            shared_cache.slot_size,
+        )
+
+    if args.workers > 1:
+        # The workers' pools together stay within POOL_MAX_IDLE sockets
+        upstream_pool.max_idle = max(1, POOL_MAX_IDLE // args.workers)
 
-    proxy_server(args.cache_size)
+    if args.workers > 1 and backend == "shared":
+        workers.run_workers(
+            args.workers, lambda worker_id: serve(args.cache_size, CACHE_DIR, True)
+        )
+    elif args.workers > 1:
+        # Connections land on any worker, so each keeps its own slice of
+        # the cache budgets in its own directory under CACHE_DIR
+        CACHE_MEMORY_BYTES //= args.workers
+        CACHE_DISK_BYTES //= args.workers
+        worker_cache_size = max(1, args.cache_size // args.workers)
+        workers.run_workers(
+            args.workers,
+            lambda worker_id: serve(
+                worker_cache_size,
+                os.path.join(CACHE_DIR, f"worker-{worker_id}"),
+                True,
+            ),
+        )
+    else:
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        serve(args.cache_size, CACHE_DIR, False)
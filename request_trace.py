@@ -0,0 +1,115 @@
+import os
+import math
+import time
+import atexit
+import struct
+from collections import namedtuple
+from threading import Lock, Thread
+
+MAGIC = b"PXTRACE1"  # Starts every trace file; the digit is the format version
+FLUSH_BYTES = 65536  # Buffered record bytes written at once
+FLUSH_INTERVAL = 1.0  # Seconds records may stay buffered
+
+# timestamp, duration, upstream seconds (NaN without an upstream request),
+# bytes sent, status, cache outcome, key length; the key bytes follow
+_RECORD = struct.Struct("<dffIHBH")
+OUTCOMES = ("-", "HIT", "STALE", "COALESCED", "REVALIDATED", "MISS", "BYPASS", "ERROR", "NEGATIVE")
+_OUTCOME_CODES = {outcome: code for code, outcome in enumerate(OUTCOMES)}
+
+Record = namedtuple("Record", "timestamp key status size outcome duration upstream")
+
+
+class TraceWriter:
+    """Appends one compact binary record per request to a trace file.
+
+    Records are buffered and written with O_APPEND in whole-record
+    batches, so forked workers can share one file without interleaving
+    inside a record. A background thread writes the buffer at least
+    every FLUSH_INTERVAL, so an idle process does not sit on records. A
+    child discards the buffer inherited from its parent, and anything
+    still buffered is written at exit; workers.at_exit(flush) covers
+    workers, which skip atexit.
+    """
+
+    def __init__(self, path):
+        self.fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        if os.fstat(self.fd).st_size == 0:
+            os.write(self.fd, MAGIC)
+        self.lock = Lock()
+        self.buffer = bytearray()
+        self.flushed_at = time.monotonic()
+        self.flusher = None  # Started by the first record in each process
+        atexit.register(self.flush)
+        os.register_at_fork(after_in_child=self._reset)
+
+    def record(self, key, status, size, outcome, duration, upstream=None):
+        key_bytes = key.encode("utf-8", "replace")[:65535]
+        data = _RECORD.pack(
+            time.time(),
+            duration,
+            math.nan if upstream is None else upstream,
+            size if isinstance(size, int) else 0,
+            int(status) if str(status).isdigit() else 0,
+            _OUTCOME_CODES.get(outcome, 0),
+            len(key_bytes),
+        )
+        now = time.monotonic()
+        if self.flusher is None:
+            self._start_flusher()
+        with self.lock:
+            self.buffer += data + key_bytes
+            if len(self.buffer) < FLUSH_BYTES and now - self.flushed_at < FLUSH_INTERVAL:
+                return
+            pending = bytes(self.buffer)
+            self.buffer.clear()
+            self.flushed_at = now
+        os.write(self.fd, pending)
+
+    def flush(self):
+        with self.lock:
+            pending = bytes(self.buffer)
+            self.buffer.clear()
+        if pending:
+            os.write(self.fd, pending)
+
+    def _start_flusher(self):
+        with self.lock:
+            if self.flusher is not None:
+                return
+            self.flusher = Thread(target=self._flush_periodically, daemon=True)
+        self.flusher.start()
+
+    def _flush_periodically(self):
+        while True:
+            time.sleep(FLUSH_INTERVAL)
+            self.flush()
+
+    def _reset(self):
+        # Threads do not survive fork, so the child starts its own flusher
+        self.lock = Lock()
+        self.buffer = bytearray()
+        self.flusher = None
+
+
+def read_trace(path):
+    """Yield the Records of a trace file in the order they were written."""
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a trace file")
+        while True:
+            fixed = f.read(_RECORD.size)
+            if len(fixed) < _RECORD.size:
+                return  # End of file, or a record cut short by a crash
+            timestamp, duration, upstream, size, status, outcome, key_len = _RECORD.unpack(fixed)
+            key = f.read(key_len)
+            if len(key) < key_len:
+                return
+            yield Record(
+                timestamp,
+                key.decode("utf-8", "replace"),
+                status,
+                size,
+                OUTCOMES[outcome] if outcome < len(OUTCOMES) else "-",
+                duration,
+                None if math.isnan(upstream) else upstream,
+            )
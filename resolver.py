@@ -0,0 +1,193 @@
+import os
+import time
+import errno
+import socket
+import selectors
+import concurrent.futures
+from collections import OrderedDict
+from threading import Lock
+import metrics
+from single_flight import SingleFlight
+
+TTL = 60  # Seconds a successful lookup is reused
+NEGATIVE_TTL = 5  # Seconds a failed lookup is remembered
+MAX_ENTRIES = 4096  # Names cached before the least recently stored are dropped
+THREADS = 8  # Concurrent getaddrinfo calls
+LOOKUP_TIMEOUT = 5  # Seconds to wait for getaddrinfo
+CONNECT_TIMEOUT = 10  # Seconds to wait for any address to accept
+ATTEMPT_DELAY = 0.25  # Happy Eyeballs: head start of each address over the next
+
+lookups_total = metrics.Counter(
+    "proxy_dns_lookups_total",
+    "Name resolutions, by result (hit, miss, negative hit, override)",
+    ("result",),
+)
+lookup_seconds = metrics.Histogram(
+    "proxy_dns_lookup_seconds", "Time spent in getaddrinfo on cache misses"
+)
+
+
+class Resolver:
+    """Caching name resolver for external origins.
+
+    Successful lookups are reused for ttl seconds and failures for
+    negative_ttl, so a burst of requests to one host costs one
+    getaddrinfo. Concurrent misses for a name share a single lookup, and
+    lookups run on a bounded pool so a slow DNS server ties up at most
+    threads of them. overrides maps names to addresses, like /etc/hosts,
+    and getaddrinfo can be swapped for a stub in tests.
+    """
+
+    def __init__(
+        self,
+        ttl=TTL,
+        negative_ttl=NEGATIVE_TTL,
+        threads=THREADS,
+        overrides=None,
+        getaddrinfo=socket.getaddrinfo,
+    ):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.overrides = overrides or {}  # name -> [address]
+        self.getaddrinfo = getaddrinfo
+        self.cache = OrderedDict()  # (name, port) -> (expires_at, addresses or error)
+        self.lock = Lock()
+        self.flights = SingleFlight()
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=threads, thread_name_prefix="resolver"
+        )
+
+    def resolve(self, host, port):
+        """Return [(family, sockaddr)] for host, interleaving address families.
+
+        Raises socket.gaierror when the name does not resolve.
+        """
+        if host in self.overrides:
+            lookups_total.inc("override")
+            return [_sockaddr(address, port) for address in self.overrides[host]]
+
+        key = (host, port)
+        with self.lock:
+            cached = self.cache.get(key)
+        if cached is not None and cached[0] > time.monotonic():
+            if isinstance(cached[1], Exception):
+                lookups_total.inc("negative")
+                raise cached[1]
+            lookups_total.inc("hit")
+            return cached[1]
+
+        lookups_total.inc("miss")
+        return self.flights.do(key, lambda: self._lookup(host, port))
+
+    def create_connection(self, host, port, timeout=CONNECT_TIMEOUT):
+        """Resolve host and connect to the first of its addresses to answer."""
+        return connect_first(self.resolve(host, port), timeout)
+
+    def _lookup(self, host, port):
+        started = time.monotonic()
+        future = self.executor.submit(self.getaddrinfo, host, port, 0, socket.SOCK_STREAM)
+        try:
+            infos = future.result(LOOKUP_TIMEOUT)
+        except concurrent.futures.TimeoutError:
+            error = socket.gaierror(socket.EAI_AGAIN, f"Lookup of {host} timed out")
+            self._store((host, port), error, self.negative_ttl)
+            raise error
+        except socket.gaierror as e:
+            self._store((host, port), e, self.negative_ttl)
+            raise
+        finally:
+            lookup_seconds.observe(time.monotonic() - started)
+
+        addresses = _interleave([(info[0], info[4]) for info in infos])
+        self._store((host, port), addresses, self.ttl)
+        return addresses
+
+    def _store(self, key, result, ttl):
+        with self.lock:
+            self.cache.pop(key, None)
+            self.cache[key] = (time.monotonic() + ttl, result)
+            while len(self.cache) > MAX_ENTRIES:
+                self.cache.popitem(last=False)
+
+
+def connect_first(addresses, timeout=CONNECT_TIMEOUT, delay=ATTEMPT_DELAY):
+    """Connect to whichever address accepts first (Happy Eyeballs, RFC 8305).
+
+    Attempts start in order, each delay seconds after the previous one or
+    as soon as it fails, and run concurrently on non-blocking sockets.
+    The first to connect is returned in blocking mode and the rest are
+    closed, so one dead address costs delay instead of a full timeout.
+    """
+    selector = selectors.DefaultSelector()
+    pending = {}  # socket -> sockaddr of attempts in progress
+    remaining = list(addresses)
+    deadline = time.monotonic() + timeout
+    next_attempt = time.monotonic()
+    last_error = None
+    try:
+        while remaining or pending:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            if remaining and (now >= next_attempt or not pending):
+                family, sockaddr = remaining.pop(0)
+                sock = socket.socket(family, socket.SOCK_STREAM)
+                sock.setblocking(False)
+                error = sock.connect_ex(sockaddr)
+                if error in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+                    selector.register(sock, selectors.EVENT_WRITE)
+                    pending[sock] = sockaddr
+                    next_attempt = now + delay
+                else:
+                    sock.close()
+                    last_error = OSError(error, os.strerror(error))
+                continue
+
+            wait = deadline - now
+            if remaining:
+                wait = min(wait, next_attempt - now)
+            for key, _ in selector.select(max(0, wait)):
+                sock = key.fileobj
+                selector.unregister(sock)
+                del pending[sock]
+                error = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                if error == 0:
+                    sock.setblocking(True)
+                    return sock
+                sock.close()
+                last_error = OSError(error, os.strerror(error))
+        raise last_error or socket.timeout("Connection attempts timed out")
+    finally:
+        for sock in pending:
+            sock.close()
+        selector.close()
+
+
+def load_hosts(path):
+    """Read an /etc/hosts-style file into a name -> [address] dict."""
+    overrides = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            fields = line.split("#", 1)[0].split()
+            for name in fields[1:]:
+                overrides.setdefault(name, []).append(fields[0])
+    return overrides
+
+
+def _sockaddr(address, port):
+    if ":" in address:
+        return socket.AF_INET6, (address, port, 0, 0)
+    return socket.AF_INET, (address, port)
+
+
+def _interleave(addresses):
+    # Alternate families, starting with the one getaddrinfo preferred, so
+    # a broken IPv6 path falls back to IPv4 after one attempt
+    if not addresses:
+        return addresses
+    first = [a for a in addresses if a[0] == addresses[0][0]]
+    other = [a for a in addresses if a[0] != addresses[0][0]]
+    result = []
+    for i in range(max(len(first), len(other))):
+        result += first[i : i + 1] + other[i : i + 1]
+    return result
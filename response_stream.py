@@ -0,0 +1,98 @@
+CHUNK_SIZE = 16384  # Largest body piece read and forwarded at once
+MAX_HEAD_SIZE = 65536  # Largest response head or chunk-size line accepted
+
+
+class UpstreamResponse:
+    """An HTTP response read off a socket: head up front, body streamed.
+
+    The constructor reads and parses the status line and headers. body()
+    then yields the body exactly as it arrived on the wire, chunked
+    framing included, in pieces of at most CHUNK_SIZE bytes, so a caller
+    can forward and store it without ever holding more than one piece.
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.buffer = b""
+        self.complete = False
+
+        self.head = self._read_until(b"\r\n\r\n")[:-4]
+        lines = self.head.split(b"\r\n")
+        self.status = int(lines[0].split(b" ", 2)[1])
+        self.headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(b":")
+            self.headers[name.strip().lower().decode("latin-1")] = value.strip().decode(
+                "latin-1"
+            )
+
+        if self.status in (204, 304) or self.status < 200:
+            self.framing = "none"
+        elif "chunked" in self.headers.get("transfer-encoding", "").lower():
+            self.framing = "chunked"
+        elif "content-length" in self.headers:
+            self.framing = "length"
+            self.length = int(self.headers["content-length"])
+        else:
+            self.framing = "eof"  # The server closes the socket to end the body
+
+    @property
+    def reusable(self):
+        # Only a fully read, self-delimited response leaves the socket clean
+        return (
+            self.complete
+            and self.framing != "eof"
+            and self.headers.get("connection", "").lower() != "close"
+        )
+
+    def body(self):
+        if self.framing == "length":
+            yield from self._read_exactly(self.length)
+        elif self.framing == "chunked":
+            while True:
+                size_line = self._read_until(b"\r\n")
+                yield size_line
+                size = int(size_line.split(b";", 1)[0], 16)
+                if size == 0:
+                    break
+                yield from self._read_exactly(size + 2)  # Data plus its CRLF
+            # Optional trailers, ended by an empty line
+            while True:
+                line = self._read_until(b"\r\n")
+                yield line
+                if line == b"\r\n":
+                    break
+        elif self.framing == "eof":
+            while True:
+                piece = self._recv(CHUNK_SIZE)
+                if not piece:
+                    break
+                yield piece
+        self.complete = True
+
+    def _recv(self, size):
+        if self.buffer:
+            piece, self.buffer = self.buffer[:size], self.buffer[size:]
+            return piece
+        return self.sock.recv(size)
+
+    def _read_exactly(self, size):
+        while size:
+            piece = self._recv(min(size, CHUNK_SIZE))
+            if not piece:
+                raise ConnectionError("Web server closed the connection mid-response")
+            size -= len(piece)
+            yield piece
+
+    def _read_until(self, delimiter):
+        # Returns everything up to and including delimiter
+        while delimiter not in self.buffer:
+            if len(self.buffer) > MAX_HEAD_SIZE:
+                raise ValueError("Response head too large")
+            data = self.sock.recv(CHUNK_SIZE)
+            if not data:
+                raise ConnectionError("Web server closed the connection")
+            self.buffer += data
+        end = self.buffer.index(delimiter) + len(delimiter)
+        data, self.buffer = self.buffer[:end], self.buffer[end:]
+        return data
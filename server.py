@@ -1,5 +1,13 @@
-import socket, threading, argparse
+import socket, threading, argparse, time, signal, logging, selectors
 import concurrent.futures  # Added import
+from functools import lru_cache
+import logs
+import metrics
+from http_parser import RequestParser, BadRequest, bad_request, wants_keep_alive, page_size
+from admission import RequestQueue, Overloaded
+import admission
+import workers
+from email.utils import formatdate, parsedate_to_datetime
 
 # Check active IP addresses on your local machine by:
 # MacOS/Linux: ifconfig
@@ -7,11 +15,67 @@ import concurrent.futures  # Added import
 HOST = "127.0.0.1"
 PORT = 8080  # Default port number
 BASE_SENTENCE = "Hello,World!"
+MAX_AGE = 60  # Seconds caches may reuse a page without revalidating
+PAGE_CACHE_SIZE = 4096  # Encoded responses memoized, at most ~20 KB each
 
 parser = argparse.ArgumentParser()
 parser.add_argument("port", type=int, help="Port number")
+parser.add_argument(
+    "--workers",
+    type=int,
+    default=1,
+    help="Processes sharing the port through SO_REUSEPORT (default: 1)",
+)
+parser.add_argument(
+    "--max-age",
+    type=int,
+    default=MAX_AGE,
+    help=f"Cache-Control max-age sent with pages (default: {MAX_AGE})",
+)
+parser.add_argument(
+    "--max-queue",
+    type=int,
+    default=admission.MAX_QUEUE,
+    help=f"Requests that may wait for a worker thread (default: {admission.MAX_QUEUE})",
+)
+parser.add_argument(
+    "--queue-target-delay",
+    type=float,
+    default=admission.TARGET_DELAY,
+    help="Seconds of queueing tolerated once a standing queue forms; "
+    f"requests waiting longer get a 503 (default: {admission.TARGET_DELAY})",
+)
+parser.add_argument(
+    "--queue-interval",
+    type=float,
+    default=admission.INTERVAL,
+    help=f"Seconds over which queueing delay is judged (default: {admission.INTERVAL})",
+)
+parser.add_argument(
+    "--log-level",
+    choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+    default=logs.LEVEL,
+    help=f"Lowest level logged; INFO includes the access log (default: {logs.LEVEL})",
+)
+parser.add_argument(
+    "--access-log-sample",
+    type=float,
+    default=logs.ACCESS_SAMPLE,
+    help=f"Fraction of requests written to the access log (default: {logs.ACCESS_SAMPLE})",
+)
+parser.add_argument(
+    "--log-file",
+    help="Write the log to this file instead of standard output",
+)
 args = parser.parse_args()
 PORT = args.port
+MAX_AGE = args.max_age
+logs.setup(args.log_level, args.access_log_sample, args.log_file)
+log = logging.getLogger("server")
+
+# Pages depend only on their size, so they last changed when we started
+START_TIME = int(time.time())
+LAST_MODIFIED = formatdate(START_TIME, usegmt=True)
 
 # Define a set of standard HTTP methods
 STANDARD_HTTP_METHODS = {
@@ -26,75 +90,273 @@ STANDARD_HTTP_METHODS = {
     "PATCH"
 }
 
-def handle_client(client_socket, address):
-    # Receive the request from the client
-    try:
-        request = client_socket.recv(1024).decode("utf-8")
-        print(f"Received request from {address}: \n{request}")
-        if not request:
-            client_socket.close()
-            return
+KEEP_ALIVE_TIMEOUT = 5  # Seconds an idle persistent connection is kept open
+MAX_REQUEST_SIZE = 8192  # Largest request head accepted on a connection
 
-        # Parse the request line (the first line of the request)
-        request_line = request.splitlines()[0]
-        is_valid, result = parse_and_validate_uri(request_line)
-
-        # Handle the response based on validation
-        if is_valid:
-            # Generate the HTML page
-            document_size = result
-            html_content = generate_html_page(document_size)
-            response = (
-                f"HTTP/1.1 200 OK\r\n"
-                f"Content-Type: text/html\r\n"
-                f"Content-Length: {document_size}\r\n"
-                f"\r\n"
-                f"{html_content}"
-            )
-        else:
-            response = f"HTTP/1.1 {result}\r\n\r\n{result.split(':', 1)[1].strip()}"
-
-        # Send the response
-        print(f"Sending response to {address}: \n{response}")
-        client_socket.sendall(response.encode("utf-8"))
-    except Exception as e:
-        print(f"Error handling client {address}: {e}")
-    finally:
-        client_socket.close()
+# Served at metrics.PATH; every worker process keeps its own
+ROUTES = {b"200": "page", b"304": "not_modified"}  # Anything else is "error"
+requests_total = metrics.Counter(
+    "server_requests_total", "Requests answered, by route and status", ("route", "status")
+)
+request_seconds = metrics.Histogram(
+    "server_request_duration_seconds", "Time to build and send a response", ("route",)
+)
+active_connections = metrics.Gauge(
+    "server_active_connections", "Client connections currently open"
+)
 
 
-def parse_and_validate_uri(request_line):
-    try:
-        # Get the URI
-        parts = request_line.split()
-
-        # Check if the URI format is valid
-        if (
-            len(parts) != 3
-            or not parts[1].startswith("/")
-            or not parts[1][1:].isdigit()
-        ):
-            return False, "400 Bad Request: Malformed or invalid URI"
-
-        # Convert to int and control the size range
-        document_size = int(parts[1][1:])
-        if not (100 <= document_size <= 20000):
-            return False, "400 Bad Request: Size out of range"
-
-        # Check if the method is a standard HTTP method
-        # curl -v -X FOO http://localhost:8080/500
-        if parts[0] not in STANDARD_HTTP_METHODS:
-            return False, "400 Bad Request: Invalid HTTP method"
-
-        # check the GET method
-        if parts[0] != "GET":
-            return False, "501 Not Implemented: Only GET method is supported"
-
-        # If valid, return the size
-        return True, document_size
+class Connection:
+    """A client connection and the parser holding its unanswered bytes."""
+
+    def __init__(self, client_socket, address):
+        self.socket = client_socket
+        self.client = f"{address[0]}:{address[1]}"
+        self.parser = RequestParser(MAX_REQUEST_SIZE)
+        self.request = None  # A pipelined request parsed but not yet answered
+        self.idle_since = time.monotonic()
+
+
+class ConnectionLoop:
+    """Accepts connections and holds them while they are idle.
+
+    A worker thread only runs while a connection has something to answer;
+    between requests a keep-alive connection waits in this selector, so
+    idle clients cost no thread and cannot starve busy ones. Connections
+    idle for KEEP_ALIVE_TIMEOUT are closed here.
+    """
+
+    def __init__(self, server_socket, dispatch):
+        self.server_socket = server_socket
+        self.dispatch = dispatch  # Called with each connection that becomes readable
+        self.selector = selectors.DefaultSelector()
+        self.lock = threading.Lock()
+        self.parked = []  # Connections handed back by worker threads
+        self.wake_reader, self.wake_writer = socket.socketpair()
+        self.wake_writer.setblocking(False)
+
+    def park(self, connection):
+        """Wait for the connection's next request; called from any thread."""
+        connection.idle_since = time.monotonic()
+        with self.lock:
+            self.parked.append(connection)
+        try:
+            self.wake_writer.send(b"\0")
+        except OSError:
+            pass  # Wakeups already pending, or the loop has shut down
+
+    def run(self):
+        self.selector.register(self.server_socket, selectors.EVENT_READ)
+        self.selector.register(self.wake_reader, selectors.EVENT_READ)
+        next_sweep = time.monotonic() + 1
+        while True:
+            for key, _ in self.selector.select(timeout=1):
+                if key.fileobj is self.server_socket:
+                    client_socket, address = self.server_socket.accept()
+                    active_connections.inc()
+                    self.dispatch(Connection(client_socket, address))
+                elif key.fileobj is self.wake_reader:
+                    self.wake_reader.recv(4096)
+                    with self.lock:
+                        parked, self.parked = self.parked, []
+                    for connection in parked:
+                        self.selector.register(
+                            connection.socket, selectors.EVENT_READ, connection
+                        )
+                else:
+                    self.selector.unregister(key.fileobj)
+                    self.dispatch(key.data)
+            now = time.monotonic()
+            if now >= next_sweep:
+                next_sweep = now + 1
+                for key in list(self.selector.get_map().values()):
+                    connection = key.data
+                    if connection is not None and now - connection.idle_since > KEEP_ALIVE_TIMEOUT:
+                        self.selector.unregister(key.fileobj)
+                        close_connection(connection)
+
+    def close(self):
+        self.selector.close()
+        self.wake_reader.close()
+        self.wake_writer.close()
+
+
+def close_connection(connection):
+    active_connections.dec()
+    connection.socket.close()
 
+
+def handle_client(connection):
+    # Runs on a worker thread once the connection has a pipelined request
+    # or is readable, and answers one request. Returns whether the
+    # connection stays open for more; a further pipelined request is left
+    # in connection.request to queue again.
+    connection.socket.settimeout(KEEP_ALIVE_TIMEOUT)
+    try:
+        request, connection.request = connection.request, None
+        if request is None:
+            data = connection.socket.recv(4096)
+            if not data:
+                return False
+            connection.parser.feed(data)
+            request = connection.parser.next_request()
+            if request is None:
+                return True  # Wait, off the thread, for the rest
+        if not answer(connection, request):
+            return False
+        connection.request = connection.parser.next_request()
+        return True
+    except socket.timeout:
+        return False
+    except BadRequest as e:
+        log.warning("Bad request from %s: %s", connection.client, e)
+        connection.socket.sendall(bad_request(e))
+        return False
     except Exception as e:
-        return False, f"400 Bad Request: {str(e)}"
+        log.error("Error handling client %s: %s", connection.client, e)
+        return False
+
+
+def answer(connection, request):
+    # Send the response to one request; returns whether to keep the connection
+    started = time.monotonic()
+    log.debug("Received request from %s: %s", connection.client, request.line)
+
+    if request.target.split("?", 1)[0] == metrics.PATH:
+        keep_alive = wants_keep_alive(request)
+        response = metrics.response(keep_alive)
+        route = "metrics"
+    else:
+        response, keep_alive = build_response(request)
+        route = ROUTES.get(response[9:12], "error")
+
+    # Send the response
+    connection.socket.sendall(response)
+    status = response[9:12].decode("latin-1")
+    logs.access(connection.client, request.line, status, len(response), started)
+    requests_total.inc(route, status)
+    request_seconds.observe(time.monotonic() - started, route)
+    return keep_alive
+
+
+def build_response(request):
+    is_valid, result = parse_and_validate_uri(request)
+    keep_alive = wants_keep_alive(request)
+
+    # Handle the response based on validation
+    if is_valid:
+        document_size = result
+        if not is_modified(request, page_etag(document_size)):
+            return render_not_modified(document_size, keep_alive), keep_alive
+        return render_page(document_size, keep_alive), keep_alive
+
+    # Errors end the connection so a bad client cannot keep it busy
+    message = result.split(":", 1)[1].strip()
+    response = (
+        f"HTTP/1.1 {result}\r\n"
+        f"Content-Type: text/html\r\n"
+        f"Content-Length: {len(message)}\r\n"
+        f"Connection: close\r\n"
+        f"\r\n"
+        f"{message}"
+    )
+    return response.encode("utf-8"), False
+
+
+# A page depends only on its size (and the Connection header), so the
+# fully encoded response is built once and reused for every request
+@lru_cache(maxsize=PAGE_CACHE_SIZE)
+def render_page(document_size, keep_alive):
+    html_content = generate_html_page(document_size)
+    response = (
+        f"HTTP/1.1 200 OK\r\n"
+        f"Content-Type: text/html\r\n"
+        f"Content-Length: {len(html_content)}\r\n"
+        f"{validator_headers(document_size)}"
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+        f"\r\n"
+        f"{html_content}"
+    )
+    return response.encode("utf-8")
+
+
+@lru_cache(maxsize=PAGE_CACHE_SIZE)
+def render_not_modified(document_size, keep_alive):
+    response = (
+        f"HTTP/1.1 304 Not Modified\r\n"
+        f"{validator_headers(document_size)}"
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+        f"\r\n"
+    )
+    return response.encode("utf-8")
+
+
+metrics.Counter(
+    "server_page_cache_lookups_total",
+    "Lookups of memoized page responses, by result",
+    ("result",),
+    function=lambda: {
+        ("hit",): render_page.cache_info().hits,
+        ("miss",): render_page.cache_info().misses,
+    },
+)
+metrics.Gauge(
+    "server_page_cache_entries",
+    "Memoized page responses",
+    function=lambda: render_page.cache_info().currsize,
+)
+
+
+def page_etag(document_size):
+    return f'"{document_size:x}-{START_TIME:x}"'
+
+
+def validator_headers(document_size):
+    return (
+        f"ETag: {page_etag(document_size)}\r\n"
+        f"Last-Modified: {LAST_MODIFIED}\r\n"
+        f"Cache-Control: max-age={MAX_AGE}\r\n"
+    )
+
+
+def is_modified(request, etag):
+    # If-None-Match takes precedence; If-Modified-Since is only consulted
+    # when the client sent no entity tags
+    if_none_match = request.header("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return not ("*" in tags or etag in tags or f"W/{etag}" in tags)
+    if_modified_since = request.header("if-modified-since")
+    if if_modified_since is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return True
+        return START_TIME > since
+    return True
+
+
+def parse_and_validate_uri(request):
+    # Check if the URI format is valid
+    document_size = page_size(request.target)
+    if document_size is None or not request.version or " " in request.version:
+        return False, "400 Bad Request: Malformed or invalid URI"
+
+    # Control the size range
+    if not (100 <= document_size <= 20000):
+        return False, "400 Bad Request: Size out of range"
+
+    # Check if the method is a standard HTTP method
+    # curl -v -X FOO http://localhost:8080/500
+    if request.method not in STANDARD_HTTP_METHODS:
+        return False, "400 Bad Request: Invalid HTTP method"
+
+    # check the GET method
+    if request.method != "GET":
+        return False, "501 Not Implemented: Only GET method is supported"
+
+    # If valid, return the size
+    return True, document_size
 
 
 def generate_html_page(document_size):
@@ -121,23 +383,64 @@ def generate_html_page(document_size):
 # Define the number of worker threads in the thread pool
 MAX_WORKERS = 50  # You can adjust this number based on your needs
 
-# Initialize the ThreadPoolExecutor
-executor = concurrent.futures.ThreadPoolExecutor(max_workers=MAX_WORKERS)
-
-server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-server_socket.bind((HOST, PORT))
-server_socket.listen()
-
-print(f"Server listening on {HOST}:{PORT}")
-
-try:
-    while True:
-        client_socket, client_address = server_socket.accept()
-        # Submit the handle_client task to the thread pool
-        executor.submit(handle_client, client_socket, client_address)
-except KeyboardInterrupt:
-    print("\nShutting down the server gracefully...")
-finally:
-    server_socket.close()
-    executor.shutdown(wait=True)
-    print("Server has been shut down.")
\ No newline at end of file
+
+def serve_queued(loop, queue, joined, connection):
+    # Runs on a worker thread for one request; requests that waited too
+    # long are shed. A pipelined request behind it queues again, so each
+    # request is judged on its own wait, and an idle connection goes back
+    # to the loop.
+    try:
+        keep_open = queue.run(joined, handle_client, connection)
+    except Overloaded as e:
+        admission.reject(connection.socket, e)
+        keep_open = False
+    if not keep_open:
+        close_connection(connection)
+    elif connection.request is not None:
+        loop.dispatch(connection)
+    else:
+        loop.park(connection)
+
+
+def run_server(reuse_port=False):
+    # Initialize the ThreadPoolExecutor
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=MAX_WORKERS)
+    # Bounds the executor's queue and sheds from it by queueing delay
+    queue = RequestQueue(0, args.max_queue, args.queue_target_delay, args.queue_interval)
+
+    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    server_socket.bind((HOST, PORT))
+    server_socket.listen()
+
+    log.info("Server listening on %s:%d", HOST, PORT)
+
+    def dispatch(connection):
+        # Each request, read or pipelined, queues for a worker thread
+        try:
+            joined = queue.join()
+        except Overloaded as e:
+            admission.reject(connection.socket, e)
+            close_connection(connection)
+            return
+        executor.submit(serve_queued, loop, queue, joined, connection)
+
+    loop = ConnectionLoop(server_socket, dispatch)
+    try:
+        loop.run()
+    except KeyboardInterrupt:
+        log.info("Shutting down the server gracefully...")
+    finally:
+        server_socket.close()
+        executor.shutdown(wait=True)
+        loop.close()
+        log.info("Server has been shut down.")
+
+
+if args.workers > 1:
+    workers.run_workers(args.workers, lambda worker_id: run_server(reuse_port=True))
+else:
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    run_server()
@@ -0,0 +1,244 @@
+import json
+import mmap
+import time
+import struct
+import hashlib
+import logging
+import multiprocessing
+from cache import Entry
+
+MEMORY_BYTES = 64 * 1024 * 1024  # Size of the shared slot region
+SLOT_SIZE = 32 * 1024  # Largest entry (key, metadata and value) that fits
+
+# CLOCK hand, entries, then hit, miss and eviction counters
+_HEADER = struct.Struct("<IIQQQ")
+# Per slot: in use, referenced, key length, meta length, value length,
+# stored_at, key hash; followed by key, meta JSON and value bytes
+_SLOT = struct.Struct("<BBHIIdQ")
+_STATS = ("entries", "hits", "misses", "evictions")
+_EMPTY = -1
+
+log = logging.getLogger(__name__)
+
+
+class SharedCache:
+    """Cache shared by forked worker processes through one mmap region.
+
+    The region is anonymous shared memory created before the workers
+    fork, so all of them map the same pages and a hit in one worker is a
+    hit in every other. It holds a fixed number of equal-sized slots, an
+    open-addressing hash index from key to slot, and the hand of a CLOCK
+    eviction policy (an LRU approximation that only needs one reference
+    bit per slot). A multiprocessing lock, also created before the fork,
+    guards it. Entries live in memory only and do not survive a restart.
+    With max_size, there are at most that many slots.
+    """
+
+    def __init__(self, memory_bytes=MEMORY_BYTES, slot_size=SLOT_SIZE, max_size=None):
+        self.slot_size = slot_size
+        self.slot_count = max(1, memory_bytes // slot_size)
+        if max_size is not None:  # Entry cap, as cache_size is for Cache
+            self.slot_count = max(1, min(self.slot_count, max_size))
+        self.bucket_count = 1
+        while self.bucket_count < 2 * self.slot_count:  # Load factor <= 0.5
+            self.bucket_count *= 2
+        self.mask = self.bucket_count - 1
+
+        buckets_offset = _HEADER.size
+        self.slots_offset = buckets_offset + 4 * self.bucket_count
+        self.region = mmap.mmap(-1, self.slots_offset + self.slot_count * slot_size)
+        self.buckets = memoryview(self.region)[buckets_offset : self.slots_offset].cast("i")
+        self.region[buckets_offset : self.slots_offset] = b"\xff" * (4 * self.bucket_count)
+        self.lock = multiprocessing.Lock()
+
+    def exists(self, key):
+        key_bytes, key_hash = _key(key)
+        with self.lock:
+            return self._find(key_bytes, key_hash)[1] != _EMPTY
+
+    def get(self, key):
+        entry = self.lookup(key)
+        return None if entry is None else entry.value
+
+    def lookup(self, key, as_file=False):
+        # Entries live in memory only, so as_file never applies
+        key_bytes, key_hash = _key(key)
+        with self.lock:
+            slot = self._find(key_bytes, key_hash)[1]
+            if slot == _EMPTY:
+                log.debug("Cache miss for key: %s", key)
+                self._count(misses=1)
+                return None
+            self._count(hits=1)
+            entry = self._entry(slot)
+        log.debug("Cache hit for key: %s", key)
+        return entry
+
+    def lookup_memory(self, key, usable):
+        # Everything is in memory, so this is lookup() without the miss:
+        # an entry that is absent or not usable(entry) is left for lookup()
+        key_bytes, key_hash = _key(key)
+        with self.lock:
+            slot = self._find(key_bytes, key_hash)[1]
+            if slot == _EMPTY:
+                return None
+            entry = self._entry(slot, referenced=False)
+            if not usable(entry):
+                return None
+            self._count(hits=1)
+            self.region[self._slot_offset(slot) + 1] = 1
+        return entry
+
+    def put(self, key, value, meta=None):
+        key_bytes, key_hash = _key(key)
+        meta_bytes = json.dumps(meta or {}, separators=(",", ":")).encode("utf-8")
+        if _SLOT.size + len(key_bytes) + len(meta_bytes) + len(value) > self.slot_size:
+            return  # Larger than a slot; not cached
+
+        with self.lock:
+            bucket, slot = self._find(key_bytes, key_hash)
+            if slot == _EMPTY:
+                slot = self._evict()
+                self._count(entries=1)
+                # Eviction may have shifted entries around our bucket
+                bucket = self._find(key_bytes, key_hash)[0]
+                self.buckets[bucket] = slot
+
+            offset = self._slot_offset(slot)
+            _SLOT.pack_into(
+                self.region,
+                offset,
+                1,
+                1,
+                len(key_bytes),
+                len(meta_bytes),
+                len(value),
+                time.time(),
+                key_hash,
+            )
+            start = offset + _SLOT.size
+            for data in (key_bytes, meta_bytes, value):
+                self.region[start : start + len(data)] = data
+                start += len(data)
+
+    def stats(self):
+        """Entry count, bytes held and hit, miss and eviction counters.
+
+        The counters live in the shared region, so they cover all workers.
+        """
+        with self.lock:
+            _, entries, hits, misses, evictions = _HEADER.unpack_from(self.region, 0)
+        return {
+            "entries": entries,
+            "memory_bytes": entries * self.slot_size,
+            "disk_bytes": 0,
+            "hits": hits,
+            "misses": misses,
+            "evictions": evictions,
+        }
+
+    def close(self):
+        pass  # Nothing to persist; the region goes away with the processes
+
+    def clear(self):
+        with self.lock:
+            self.buckets[:] = memoryview(b"\xff" * (4 * self.bucket_count)).cast("i")
+            for slot in range(self.slot_count):
+                self.region[self._slot_offset(slot)] = 0
+            self._count(entries=-self._stat("entries"))
+
+    # The helpers below expect self.lock to be held.
+
+    def _stat(self, name):
+        return _HEADER.unpack_from(self.region, 0)[_STATS.index(name) + 1]
+
+    def _count(self, **deltas):
+        values = list(_HEADER.unpack_from(self.region, 0))
+        for name, delta in deltas.items():
+            values[_STATS.index(name) + 1] += delta
+        _HEADER.pack_into(self.region, 0, *values)
+
+    def _entry(self, slot, referenced=True):
+        # Copy a slot's entry out; the caller holds the lock
+        offset = self._slot_offset(slot)
+        _, _, key_len, meta_len, value_len, stored_at, _ = _SLOT.unpack_from(
+            self.region, offset
+        )
+        if referenced:
+            self.region[offset + 1] = 1  # Referenced since the hand last passed
+        start = offset + _SLOT.size + key_len
+        meta = self.region[start : start + meta_len]
+        value = self.region[start + meta_len : start + meta_len + value_len]
+        return Entry(value, stored_at, json.loads(meta))
+
+    def _slot_offset(self, slot):
+        return self.slots_offset + slot * self.slot_size
+
+    def _slot_key(self, slot):
+        offset = self._slot_offset(slot)
+        key_len = _SLOT.unpack_from(self.region, offset)[2]
+        return self.region[offset + _SLOT.size : offset + _SLOT.size + key_len]
+
+    def _slot_hash(self, slot):
+        return _SLOT.unpack_from(self.region, self._slot_offset(slot))[6]
+
+    def _find(self, key_bytes, key_hash):
+        # Returns (bucket, slot): the key's bucket and slot if present,
+        # otherwise the empty bucket where it belongs and _EMPTY
+        bucket = key_hash & self.mask
+        while True:
+            slot = self.buckets[bucket]
+            if slot == _EMPTY:
+                return bucket, _EMPTY
+            if self._slot_hash(slot) == key_hash and self._slot_key(slot) == key_bytes:
+                return bucket, slot
+            bucket = (bucket + 1) & self.mask
+
+    def _remove_bucket(self, bucket):
+        # Backward-shift deletion keeps every probe chain unbroken
+        # without tombstones
+        self.buckets[bucket] = _EMPTY
+        hole = bucket
+        while True:
+            bucket = (bucket + 1) & self.mask
+            slot = self.buckets[bucket]
+            if slot == _EMPTY:
+                return
+            home = self._slot_hash(slot) & self.mask
+            # Move the entry into the hole unless its home lies cyclically
+            # in (hole, bucket], where it must stay to remain reachable
+            if (hole < bucket and hole < home <= bucket) or (
+                hole > bucket and (home > hole or home <= bucket)
+            ):
+                continue
+            self.buckets[hole] = slot
+            self.buckets[bucket] = _EMPTY
+            hole = bucket
+
+    def _evict(self):
+        # CLOCK: sweep from the hand, giving referenced slots a second
+        # chance, and take the first free or unreferenced one
+        hand = _HEADER.unpack_from(self.region, 0)[0]
+        while True:
+            slot = hand
+            hand = (hand + 1) % self.slot_count
+            offset = self._slot_offset(slot)
+            in_use, referenced = self.region[offset], self.region[offset + 1]
+            if not in_use:
+                break
+            if referenced:
+                self.region[offset + 1] = 0
+                continue
+            bucket = self._find(bytes(self._slot_key(slot)), self._slot_hash(slot))[0]
+            self._remove_bucket(bucket)
+            self.region[offset] = 0
+            self._count(entries=-1, evictions=1)
+            break
+        values = _HEADER.unpack_from(self.region, 0)
+        _HEADER.pack_into(self.region, 0, hand, *values[1:])
+        return slot
+
+
+def _key(key):
+    key_bytes = key.encode("utf-8")
+    return key_bytes, int.from_bytes(hashlib.blake2b(key_bytes, digest_size=8).digest(), "little")
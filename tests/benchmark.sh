@@ -0,0 +1,43 @@
+#!/bin/bash
+
+# Run load_test.py against the web server and the proxy, closed and open
+# loop, and compare every run with its stored baseline.
+# Usage: ./benchmark.sh            compare against ../test_outputs/baselines
+#        ./benchmark.sh --update   store this run as the new baselines
+
+# Define test parameters
+DURATION=10
+CONNECTIONS=50
+RATE=2000
+TARGETS=("server:8080" "proxy:8888")
+
+OUTPUT_DIR="../test_outputs/benchmarks"
+BASELINE_DIR="../test_outputs/baselines"
+mkdir -p "$OUTPUT_DIR" "$BASELINE_DIR"
+
+status=0
+for target in "${TARGETS[@]}"; do
+  name="${target%%:*}"
+  port="${target##*:}"
+  for mode in closed open; do
+    result="$OUTPUT_DIR/$name-$mode.json"
+    baseline="$BASELINE_DIR/$name-$mode.json"
+    echo "Testing $name ($mode loop)..."
+    args=(--port "$port" --mode "$mode" --duration "$DURATION"
+          --connections "$CONNECTIONS" --rate "$RATE" --output "$result")
+    if [ "$1" != "--update" ] && [ -s "$baseline" ]; then
+      args+=(--baseline "$baseline")
+    fi
+    python3 load_test.py "${args[@]}" > /dev/null || status=1
+    if [ "$1" = "--update" ]; then
+      cp "$result" "$baseline"
+    fi
+  done
+done
+
+if [ $status -ne 0 ]; then
+  echo "Regressions found. Results are stored in $OUTPUT_DIR."
+else
+  echo "Tests completed. Results are stored in $OUTPUT_DIR."
+fi
+exit $status
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import re
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from eviction import POLICIES  # noqa: E402
+from load_test import KeySampler  # noqa: E402
+
+# Define test parameters
+CAPACITIES = [100, 500, 1000]  # Cache sizes simulated, in entries
+REQUESTS = 200000  # Synthetic trace: requests
+KEYS = 5000  # Synthetic trace: distinct hot-set keys
+SCAN_EVERY = 20000  # Synthetic trace: requests between scans
+SCAN_LENGTH = 2000  # Synthetic trace: one-off keys per scan
+
+# The request line of a proxy or server access log line
+ACCESS_LINE = re.compile(r' access: \S+ "(\S+) (\S+) [^"]*"')
+
+
+def read_access_logs(paths):
+    # Yields the target of every GET in the access logs, in order
+    for path in paths:
+        with open(path, encoding="utf-8", errors="replace") as f:
+            for line in f:
+                match = ACCESS_LINE.search(line)
+                if match and match.group(1) == "GET":
+                    yield match.group(2)
+
+
+def synthetic_trace(requests, keys, scan_every, scan_length, seed):
+    # Zipf-popular sizes, interrupted by sweeps over keys seen only once,
+    # like a crawler or tests/concurrency_test.py walking the size range
+    sampler = KeySampler(keys, "zipf", 1.0, seed, 1, 10 * keys)
+    scans = 0
+    for i in range(requests):
+        if scan_every and i and i % scan_every == 0:
+            for j in range(scan_length):
+                yield f"scan-{scans}-{j}"
+            scans += 1
+        yield f"/{sampler.next()}"
+
+
+def replay(trace, policy_name, capacity):
+    """
+    Run a trace through one policy holding at most capacity entries.
+
+    :return: Tuple of hits and lookups
+    """
+    policy = POLICIES[policy_name](capacity)
+    present = set()
+    hits = 0
+    for key in trace:
+        policy.access(key)
+        if key in present:
+            hits += 1
+            continue
+        policy.add(key)
+        present.add(key)
+        if len(present) > capacity:
+            present.discard(policy.victim())
+    return hits, len(trace)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Hit ratio of each cache eviction policy on a request trace"
+    )
+    parser.add_argument("logs", nargs="*", help="Access logs to replay; a synthetic Zipf trace with scans when omitted")
+    parser.add_argument("--capacity", type=int, nargs="+", default=CAPACITIES, help="Cache sizes in entries")
+    parser.add_argument("--policy", choices=list(POLICIES), nargs="+", default=list(POLICIES), help="Policies to compare")
+    parser.add_argument("--requests", type=int, default=REQUESTS, help="Synthetic trace: requests")
+    parser.add_argument("--keys", type=int, default=KEYS, help="Synthetic trace: distinct keys")
+    parser.add_argument("--scan-every", type=int, default=SCAN_EVERY, help="Synthetic trace: requests between scans, 0 for none")
+    parser.add_argument("--scan-length", type=int, default=SCAN_LENGTH, help="Synthetic trace: keys per scan")
+    parser.add_argument("--seed", type=int, default=1, help="Synthetic trace: seed")
+    args = parser.parse_args()
+
+    if args.logs:
+        trace = list(read_access_logs(args.logs))
+        source = ", ".join(args.logs)
+    else:
+        trace = list(
+            synthetic_trace(args.requests, args.keys, args.scan_every, args.scan_length, args.seed)
+        )
+        source = "synthetic"
+    if not trace:
+        sys.exit("No GET requests found in the trace.")
+    print(f"Trace: {source}, {len(trace)} requests, {len(set(trace))} distinct keys")
+
+    print(f"{'capacity':>10}" + "".join(f"{name:>10}" for name in args.policy))
+    for capacity in args.capacity:
+        ratios = []
+        for name in args.policy:
+            hits, lookups = replay(trace, name, capacity)
+            ratios.append(f"{hits / lookups:>10.2%}")
+        print(f"{capacity:>10}" + "".join(ratios))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from collections import Counter
+
+# Default target: the proxy; use --port 8080 to load the web server directly
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8888
+
+# Define test parameters
+DURATION = 10  # Seconds of load
+CONNECTIONS = 50  # Closed loop: connections each sending back to back
+RATE = 1000  # Open loop: requests started per second
+KEYS = 1000  # Distinct page sizes requested
+MIN_SIZE = 100  # Smallest page the web server accepts
+MAX_SIZE = 9998  # Largest page the proxy accepts; the server alone takes 20000
+ZIPF_S = 1.0  # Zipf exponent; higher means a smaller hot set
+TOLERANCE = 0.10  # Allowed slowdown against the baseline before failing
+PERCENTILES = {"p50": 50, "p90": 90, "p99": 99, "p999": 99.9}
+
+
+class KeySampler:
+    """Pick page sizes uniformly or by Zipf popularity.
+
+    Ranks are mapped to a seeded random permutation of sizes, so the
+    popular pages are spread over the whole size range but identical from
+    run to run.
+    """
+
+    def __init__(self, keys, distribution, zipf_s, seed, min_size=MIN_SIZE, max_size=MAX_SIZE):
+        self.random = random.Random(seed)
+        self.sizes = self.random.sample(range(min_size, max_size + 1), keys)
+        self.cum_weights = None
+        if distribution == "zipf":
+            total = 0.0
+            self.cum_weights = []
+            for rank in range(1, keys + 1):
+                total += 1 / rank**zipf_s
+                self.cum_weights.append(total)
+
+    def next(self):
+        if self.cum_weights is None:
+            return self.random.choice(self.sizes)
+        return self.random.choices(self.sizes, cum_weights=self.cum_weights)[0]
+
+
+class Connection:
+    """A raw keep-alive connection that sends one GET and reads its response."""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def request(self, size):
+        """
+        Send GET /<size> and read the full response.
+
+        :return: Tuple of status code and bytes received
+        """
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.writer.write(
+            f"GET /{size} HTTP/1.1\r\nHost: {self.host}:{self.port}\r\n\r\n".encode("latin-1")
+        )
+        try:
+            head = await self.reader.readuntil(b"\r\n\r\n")
+            status = int(head.split(b" ", 2)[1])
+            headers = head.lower()
+            length = 0
+            for line in headers.split(b"\r\n"):
+                if line.startswith(b"content-length:"):
+                    length = int(line.split(b":", 1)[1])
+            body = await self.reader.readexactly(length)
+        except Exception:
+            self.close()
+            raise
+        if b"connection: close" in headers:
+            self.close()
+        return status, len(head) + len(body)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+class Results:
+    def __init__(self):
+        self.latencies = []  # Seconds
+        self.statuses = Counter()
+        self.errors = Counter()
+        self.bytes = 0
+
+    def record(self, latency, status, received):
+        self.latencies.append(latency)
+        self.statuses[status] += 1
+        self.bytes += received
+
+    def summary(self, elapsed, settings):
+        latencies = sorted(self.latencies)
+        count = len(latencies)
+
+        def percentile(p):
+            if not latencies:
+                return None
+            return round(latencies[min(count - 1, int(count * p / 100))] * 1000, 3)
+
+        return {
+            **settings,
+            "requests": count,
+            "errors": sum(self.errors.values()),
+            "error_kinds": dict(self.errors),
+            "statuses": {str(code): n for code, n in sorted(self.statuses.items())},
+            "elapsed": round(elapsed, 3),
+            "throughput": round(count / elapsed, 1) if elapsed else 0.0,
+            "bytes_per_second": round(self.bytes / elapsed, 1) if elapsed else 0.0,
+            "latency_ms": {
+                **{name: percentile(p) for name, p in PERCENTILES.items()},
+                "max": round(latencies[-1] * 1000, 3) if latencies else None,
+                "mean": round(sum(latencies) / count * 1000, 3) if latencies else None,
+            },
+        }
+
+
+async def closed_loop(args, sampler, results):
+    """
+    Keep args.connections connections busy, each sending its next request
+    as soon as the previous response arrives.
+    """
+    deadline = time.monotonic() + args.duration
+
+    async def worker():
+        connection = Connection(args.host, args.port)
+        while time.monotonic() < deadline:
+            started = time.monotonic()
+            try:
+                status, received = await connection.request(sampler.next())
+            except Exception as e:
+                results.errors[type(e).__name__] += 1
+                continue
+            results.record(time.monotonic() - started, status, received)
+        connection.close()
+
+    await asyncio.gather(*(worker() for _ in range(args.connections)))
+
+
+async def open_loop(args, sampler, results):
+    """
+    Start requests at a fixed rate whatever the server's response times.
+
+    Latency is measured from each request's scheduled start, so a server
+    that falls behind is charged for the queueing it causes instead of
+    silently slowing the generator down (coordinated omission).
+    """
+    idle = []  # Connections free for the next request
+    in_flight = set()
+    start = time.monotonic()
+    total = int(args.rate * args.duration)
+
+    async def one(scheduled, size):
+        connection = idle.pop() if idle else Connection(args.host, args.port)
+        try:
+            status, received = await connection.request(size)
+        except Exception as e:
+            results.errors[type(e).__name__] += 1
+            return
+        results.record(time.monotonic() - scheduled, status, received)
+        idle.append(connection)
+
+    for i in range(total):
+        scheduled = start + i / args.rate
+        delay = scheduled - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if len(in_flight) >= args.max_in_flight:
+            results.errors["Overloaded"] += 1  # Generator limit, not a server error
+            continue
+        task = asyncio.create_task(one(scheduled, sampler.next()))
+        in_flight.add(task)
+        task.add_done_callback(in_flight.discard)
+    if in_flight:
+        await asyncio.wait(in_flight)
+    for connection in idle:
+        connection.close()
+
+
+def compare(result, baseline, tolerance):
+    """
+    Compare a run against a stored baseline.
+
+    :return: List of regressions found, empty when the run is within tolerance
+    """
+    regressions = []
+    for setting in ("target", "mode", "connections", "rate", "keys", "distribution"):
+        if result.get(setting) != baseline.get(setting):
+            print(
+                f"Warning: {setting} differs from the baseline "
+                f"({result.get(setting)} vs {baseline.get(setting)})",
+                file=sys.stderr,
+            )
+    if result["throughput"] < baseline["throughput"] * (1 - tolerance):
+        regressions.append(
+            f"throughput {result['throughput']} < baseline {baseline['throughput']}"
+        )
+    for name in PERCENTILES:
+        current, previous = result["latency_ms"][name], baseline["latency_ms"].get(name)
+        if current is not None and previous and current > previous * (1 + tolerance):
+            regressions.append(f"{name} {current} ms > baseline {previous} ms")
+    if result["errors"] > baseline.get("errors", 0):
+        regressions.append(f"errors {result['errors']} > baseline {baseline.get('errors', 0)}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Load generator for server.py and proxy_server.py"
+    )
+    parser.add_argument("--host", default=DEFAULT_HOST, help="Target host")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="Target port (8888 proxy, 8080 server)")
+    parser.add_argument("--mode", choices=["closed", "open"], default="closed", help="closed: fixed concurrency; open: fixed arrival rate")
+    parser.add_argument("--duration", type=float, default=DURATION, help="Seconds of load")
+    parser.add_argument("--connections", type=int, default=CONNECTIONS, help="Closed loop: concurrent connections")
+    parser.add_argument("--rate", type=float, default=RATE, help="Open loop: requests per second")
+    parser.add_argument("--max-in-flight", type=int, default=10000, help="Open loop: outstanding requests before new ones are skipped")
+    parser.add_argument("--keys", type=int, default=KEYS, help="Distinct page sizes requested")
+    parser.add_argument("--distribution", choices=["uniform", "zipf"], default="zipf", help="Key popularity")
+    parser.add_argument("--min-size", type=int, default=MIN_SIZE, help="Smallest page size requested")
+    parser.add_argument("--max-size", type=int, default=MAX_SIZE, help="Largest page size requested")
+    parser.add_argument("--zipf-s", type=float, default=ZIPF_S, help="Zipf exponent")
+    parser.add_argument("--seed", type=int, default=1, help="Seed for the key sequence")
+    parser.add_argument("--output", help="Also write the JSON result to this file")
+    parser.add_argument("--baseline", help="Baseline JSON to compare against; exits 1 on regression")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE, help="Allowed relative slowdown against the baseline")
+    args = parser.parse_args()
+
+    sampler = KeySampler(
+        args.keys, args.distribution, args.zipf_s, args.seed, args.min_size, args.max_size
+    )
+    results = Results()
+    run = closed_loop if args.mode == "closed" else open_loop
+    start_time = time.monotonic()
+    asyncio.run(run(args, sampler, results))
+    elapsed = time.monotonic() - start_time
+
+    settings = {
+        "target": f"{args.host}:{args.port}",
+        "mode": args.mode,
+        "connections": args.connections if args.mode == "closed" else None,
+        "rate": args.rate if args.mode == "open" else None,
+        "duration": args.duration,
+        "keys": args.keys,
+        "distribution": args.distribution,
+    }
+    result = results.summary(elapsed, settings)
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(result, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+        print("Within tolerance of the baseline.", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from http_parser import RequestParser, parse_head, wants_keep_alive  # noqa: E402
+
+# Define test parameters
+ITERATIONS = 20000
+REQUESTS = {
+    "minimal": b"GET /500 HTTP/1.1\r\nHost: 127.0.0.1:8080\r\n\r\n",
+    "browser": (
+        b"GET /9997 HTTP/1.1\r\n"
+        b"Host: 127.0.0.1:8080\r\n"
+        b"User-Agent: Mozilla/5.0 (X11; Linux x86_64; rv:128.0) Gecko/20100101 Firefox/128.0\r\n"
+        b"Accept: text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8\r\n"
+        b"Accept-Language: en-US,en;q=0.5\r\n"
+        b"Accept-Encoding: gzip, deflate, br\r\n"
+        b"Connection: keep-alive\r\n"
+        b"If-None-Match: \"270d-67123456\"\r\n"
+        b"Upgrade-Insecure-Requests: 1\r\n"
+        b"Cache-Control: max-age=0\r\n\r\n"
+    ),
+}
+
+
+def legacy_parse(data):
+    # The string-based parsing the proxy did per request before
+    # http_parser: every step re-split the decoded request on its own
+    request = data.decode("utf-8")
+    host_line = [
+        line for line in request.splitlines() if line.startswith("Host:") or line.startswith("host:")
+    ][0]
+    lines = request.splitlines()  # wants_keep_alive
+    connection = ""
+    for line in lines[1:]:
+        name, _, value = line.partition(":")
+        if name.strip().lower() in ("connection", "proxy-connection"):
+            connection = value.strip().lower()
+    request_line = request.splitlines()[0]  # parse_and_validate_uri
+    method, target, version = request_line.split()
+    forwarded = []  # build_web_server_request
+    for line in request.splitlines():
+        if line.lower().startswith("host:"):
+            forwarded.append("Host: 127.0.0.1:8080")
+        elif line == request_line:
+            forwarded.append(f"{request_line.split(' ')[0]} {target} {request_line.split(' ')[2]}")
+        elif line.lower().startswith(("connection:", "proxy-connection:")):
+            continue
+        elif line.lower().startswith(("if-none-match:", "if-modified-since:")):
+            continue
+        elif line:
+            forwarded.append(line)
+    forwarded.append("Connection: keep-alive")
+    return host_line, connection, ("\r\n".join(forwarded) + "\r\n\r\n").encode("utf-8")
+
+
+def parse(data):
+    # The same work with one parse_head() shared by every step
+    request = parse_head(data[:-4])
+    host = request.header("host")
+    keep_alive = wants_keep_alive(request)
+    headers = [("Host", "127.0.0.1:8080")]
+    for name, value in request.headers:
+        lower_name = name.lower()
+        if lower_name not in ("host", "connection", "proxy-connection", "if-none-match", "if-modified-since"):
+            headers.append((name, value))
+    headers.append(("Connection", "keep-alive"))
+    return host, keep_alive, request.encode(request.line, headers)
+
+
+def parse_incremental(data, piece_size):
+    parser = RequestParser()
+    for i in range(0, len(data), piece_size):
+        parser.feed(data[i : i + piece_size])
+        request = parser.next_request()
+    return request
+
+
+def bench(label, fn, iterations):
+    seconds = min(timeit.repeat(fn, number=iterations, repeat=3))
+    print(f"{label:<40} {seconds / iterations * 1e6:8.2f} us/request")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-request cost of parsing HTTP requests")
+    parser.add_argument("--iterations", type=int, default=ITERATIONS, help="Requests parsed per measurement")
+    args = parser.parse_args()
+
+    for name, data in REQUESTS.items():
+        print(f"{name} request ({len(data)} bytes)")
+        bench("  legacy str parsing, proxy path", lambda: legacy_parse(data), args.iterations)
+        bench("  http_parser, proxy path", lambda: parse(data), args.iterations)
+        bench("  RequestParser, one recv", lambda: parse_incremental(data, len(data)), args.iterations)
+        bench("  RequestParser, 16-byte recvs", lambda: parse_incremental(data, 16), args.iterations)
+
+
+if __name__ == "__main__":
+    main()
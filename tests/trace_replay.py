@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from collections import Counter
+from urllib.parse import urlparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from cache import Cache, SHARDS  # noqa: E402
+from eviction import POLICIES  # noqa: E402
+from http_parser import page_size  # noqa: E402
+from load_test import Connection, Results  # noqa: E402
+from request_trace import read_trace  # noqa: E402
+
+# Default target: the proxy; use --port 8080 to replay against the web server
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8888
+CONNECTIONS = 50  # Fast replay: concurrent connections
+
+
+def page_requests(records):
+    # (timestamp, page size) of every replayable request: GET /<size>
+    # for the web server, which is all the proxy caches
+    for record in records:
+        size = page_size(urlparse(record.key).path)
+        if size is not None and record.status != 0:
+            yield record.timestamp, size
+
+
+def summary(args):
+    records = list(read_trace(args.trace))
+    if not records:
+        sys.exit("The trace is empty.")
+    upstream = sorted(r.upstream for r in records if r.upstream is not None)
+    durations = sorted(r.duration for r in records)
+
+    def percentile(values, p):
+        return round(values[min(len(values) - 1, int(len(values) * p / 100))] * 1000, 3)
+
+    result = {
+        "requests": len(records),
+        "distinct_keys": len({r.key for r in records}),
+        "seconds": round(records[-1].timestamp - records[0].timestamp, 3),
+        "outcomes": dict(Counter(r.outcome for r in records).most_common()),
+        "statuses": dict(Counter(str(r.status) for r in records).most_common()),
+        "bytes": sum(r.size for r in records),
+        "duration_ms": {"p50": percentile(durations, 50), "p99": percentile(durations, 99)},
+    }
+    if upstream:
+        result["upstream_ms"] = {
+            "requests": len(upstream),
+            "p50": percentile(upstream, 50),
+            "p99": percentile(upstream, 99),
+        }
+    print(json.dumps(result, indent=2))
+
+
+def replay_cache(args):
+    """
+    Feed the trace's keys through cache.Cache at full speed: a lookup per
+    request, and a put of the recorded size on every miss.
+    """
+    # Only page requests the cache answered: admin paths such as
+    # /__metrics carry the outcome "-" and never reach the cache
+    records = [
+        r
+        for r in read_trace(args.trace)
+        if r.status == 200 and r.outcome != "-" and page_size(urlparse(r.key).path) is not None
+    ]
+    cache_dir = tempfile.mkdtemp(prefix="trace-replay-")
+    try:
+        cache = Cache(
+            cache_dir,
+            args.cache_size,
+            int(args.memory_mb * 2**20),
+            int(args.disk_mb * 2**20),
+            args.shards,
+            args.policy,
+        )
+        started = time.monotonic()
+        for record in records:
+            key = urlparse(record.key).geturl()
+            if cache.lookup(key) is None:
+                cache.put(key, bytes(record.size))
+        elapsed = time.monotonic() - started
+        stats = cache.stats()
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    recorded = Counter(r.outcome for r in records)
+    lookups = stats["hits"] + stats["misses"]
+    recorded_lookups = sum(recorded.values())
+    recorded_hits = recorded_lookups - recorded["MISS"] - recorded["BYPASS"] - recorded["ERROR"]
+    print(
+        json.dumps(
+            {
+                "policy": args.policy,
+                "cache_size": args.cache_size,
+                "requests": len(records),
+                "hit_ratio": round(stats["hits"] / lookups, 4) if lookups else 0.0,
+                "recorded_hit_ratio": (
+                    round(recorded_hits / recorded_lookups, 4) if recorded_lookups else 0.0
+                ),
+                "evictions": stats["evictions"],
+                "lookups_per_second": round(len(records) / elapsed, 1) if elapsed else 0.0,
+            },
+            indent=2,
+        )
+    )
+
+
+async def replay_fast(args, requests, results):
+    # Closed loop: every connection sends the next request of the trace
+    # as soon as its previous response arrives
+    pending = iter(requests)
+
+    async def worker():
+        connection = Connection(args.host, args.port)
+        for _, size in pending:
+            started = time.monotonic()
+            try:
+                status, received = await connection.request(size)
+            except Exception as e:
+                results.errors[type(e).__name__] += 1
+                continue
+            results.record(time.monotonic() - started, status, received)
+        connection.close()
+
+    await asyncio.gather(*(worker() for _ in range(args.connections)))
+
+
+async def replay_recorded(args, requests, results):
+    # Open loop: each request starts at its recorded offset (divided by
+    # --speed), and latency counts from that scheduled start
+    idle = []
+    in_flight = set()
+    start = time.monotonic()
+    first = requests[0][0]
+
+    async def one(scheduled, size):
+        connection = idle.pop() if idle else Connection(args.host, args.port)
+        try:
+            status, received = await connection.request(size)
+        except Exception as e:
+            results.errors[type(e).__name__] += 1
+            return
+        results.record(time.monotonic() - scheduled, status, received)
+        idle.append(connection)
+
+    for timestamp, size in requests:
+        scheduled = start + (timestamp - first) / args.speed
+        delay = scheduled - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        task = asyncio.create_task(one(scheduled, size))
+        in_flight.add(task)
+        task.add_done_callback(in_flight.discard)
+    if in_flight:
+        await asyncio.wait(in_flight)
+    for connection in idle:
+        connection.close()
+
+
+def replay_http(args):
+    requests = list(page_requests(read_trace(args.trace)))
+    if not requests:
+        sys.exit("No GET /<size> requests found in the trace.")
+    results = Results()
+    run = replay_fast if args.timing == "fast" else replay_recorded
+    start_time = time.monotonic()
+    asyncio.run(run(args, requests, results))
+    elapsed = time.monotonic() - start_time
+
+    settings = {
+        "target": f"{args.host}:{args.port}",
+        "trace": args.trace,
+        "timing": args.timing,
+        "connections": args.connections if args.timing == "fast" else None,
+        "speed": args.speed if args.timing == "recorded" else None,
+    }
+    result = results.summary(elapsed, settings)
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Inspect and replay request traces written by proxy_server.py --trace-file"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    summary_parser = commands.add_parser("summary", help="Request, outcome and latency totals of a trace")
+    summary_parser.add_argument("trace", help="Trace file")
+    summary_parser.set_defaults(run=summary)
+
+    cache_parser = commands.add_parser("cache", help="Replay the keys through cache.Cache offline")
+    cache_parser.add_argument("trace", help="Trace file")
+    cache_parser.add_argument("--cache-size", type=int, default=1000, help="Maximum number of entries")
+    cache_parser.add_argument("--memory-mb", type=float, default=64, help="Memory tier budget in MiB")
+    cache_parser.add_argument("--disk-mb", type=float, default=1024, help="Disk tier budget in MiB")
+    cache_parser.add_argument("--shards", type=int, default=SHARDS, help="Cache shards")
+    cache_parser.add_argument("--policy", choices=list(POLICIES), default="lru", help="Eviction policy")
+    cache_parser.set_defaults(run=replay_cache)
+
+    http_parser = commands.add_parser("http", help="Replay the requests against a running proxy or server")
+    http_parser.add_argument("trace", help="Trace file")
+    http_parser.add_argument("--host", default=DEFAULT_HOST, help="Target host")
+    http_parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="Target port (8888 proxy, 8080 server)")
+    http_parser.add_argument("--timing", choices=["fast", "recorded"], default="fast", help="fast: as quickly as possible; recorded: at the recorded arrival times")
+    http_parser.add_argument("--connections", type=int, default=CONNECTIONS, help="Fast: concurrent connections")
+    http_parser.add_argument("--speed", type=float, default=1.0, help="Recorded: playback speed multiplier")
+    http_parser.add_argument("--output", help="Also write the JSON result to this file")
+    http_parser.set_defaults(run=replay_http)
+
+    args = parser.parse_args()
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+import os
+import socket
+import selectors
+
+CHUNK_SIZE = 65536  # Bytes moved per readiness event (one pipe's worth)
+IDLE_TIMEOUT = 300  # Seconds without traffic before a tunnel is torn down
+
+# Linux can move bytes socket -> pipe -> socket without copying them
+# through user space; elsewhere we fall back to recv/sendall.
+HAS_SPLICE = hasattr(os, "splice")
+
+
+class _Direction:
+    """One half of a tunnel: bytes read from src are written to dst."""
+
+    def __init__(self, src, dst):
+        self.src = src
+        self.dst = dst
+        self.pipe = os.pipe() if HAS_SPLICE else None
+
+    def transfer(self):
+        # Returns the number of bytes moved; 0 means src reached EOF
+        if self.pipe is None:
+            data = self.src.recv(CHUNK_SIZE)
+            if data:
+                self.dst.sendall(data)
+            return len(data)
+
+        read_end, write_end = self.pipe
+        moved = os.splice(self.src.fileno(), write_end, CHUNK_SIZE)
+        pending = moved
+        while pending:
+            pending -= os.splice(read_end, self.dst.fileno(), pending)
+        return moved
+
+    def close(self):
+        if self.pipe is not None:
+            for fd in self.pipe:
+                os.close(fd)
+            self.pipe = None
+
+
+def relay(client_socket, server_socket, idle_timeout=IDLE_TIMEOUT):
+    """Relay bytes both ways until both sides close or the tunnel goes idle.
+
+    Blocks in the selector between events, so an idle tunnel costs no CPU.
+    EOF on one side is passed on as a half-close so the other direction
+    can keep flowing until it finishes too.
+    """
+    selector = selectors.DefaultSelector()
+    directions = {
+        client_socket: _Direction(client_socket, server_socket),
+        server_socket: _Direction(server_socket, client_socket),
+    }
+    for sock in directions:
+        selector.register(sock, selectors.EVENT_READ)
+
+    try:
+        open_directions = len(directions)
+        while open_directions:
+            events = selector.select(timeout=idle_timeout)
+            if not events:
+                break  # Idle timeout: neither side sent anything
+
+            for key, _ in events:
+                direction = directions[key.fileobj]
+                try:
+                    moved = direction.transfer()
+                except (ConnectionError, BrokenPipeError, OSError):
+                    return  # Reset or write failure ends the whole tunnel
+
+                if not moved:
+                    selector.unregister(direction.src)
+                    open_directions -= 1
+                    try:
+                        direction.dst.shutdown(socket.SHUT_WR)
+                    except OSError:
+                        pass
+    finally:
+        selector.close()
+        for direction in directions.values():
+            direction.close()
@@ -0,0 +1,101 @@
+import socket
+import time
+from collections import deque
+from threading import Lock
+import metrics
+
+MAX_IDLE_PER_ORIGIN = 32  # Idle sockets kept for each (host, port)
+IDLE_TIMEOUT = 4  # Seconds; below server.KEEP_ALIVE_TIMEOUT so we close first
+CONNECT_TIMEOUT = 5
+
+connect_seconds = metrics.Histogram(
+    "proxy_upstream_connect_seconds", "Time to open a new connection to an origin"
+)
+acquired_total = metrics.Counter(
+    "proxy_upstream_acquired_total",
+    "Upstream sockets handed out, by whether an idle one was reused",
+    ("reused",),
+)
+
+
+class ConnectionPool:
+    """Bounded per-origin pool of idle keep-alive sockets."""
+
+    def __init__(self, max_idle=MAX_IDLE_PER_ORIGIN, idle_timeout=IDLE_TIMEOUT):
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self.idle = {}  # (host, port) -> deque of (socket, released_at)
+        self.lock = Lock()
+
+    def acquire(self, host, port):
+        """Return (socket, reused) with a healthy idle socket if one exists."""
+        origin = (host, port)
+        while True:
+            with self.lock:
+                idle = self.idle.get(origin)
+                if not idle:
+                    break
+                sock, released_at = idle.pop()  # Most recently used first
+
+            if time.monotonic() - released_at > self.idle_timeout:
+                sock.close()
+                self._evict_expired(origin)
+                continue
+            if self._is_healthy(sock):
+                acquired_total.inc("true")
+                return sock, True
+            sock.close()
+
+        started = time.monotonic()
+        sock = socket.create_connection(origin, timeout=CONNECT_TIMEOUT)
+        connect_seconds.observe(time.monotonic() - started)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        acquired_total.inc("false")
+        return sock, False
+
+    def release(self, host, port, sock):
+        """Hand a socket whose response was fully read back to the pool."""
+        with self.lock:
+            idle = self.idle.setdefault((host, port), deque())
+            if len(idle) < self.max_idle:
+                idle.append((sock, time.monotonic()))
+                return
+        sock.close()
+
+    def idle_count(self):
+        with self.lock:
+            return sum(len(idle) for idle in self.idle.values())
+
+    def close(self):
+        with self.lock:
+            idle_sockets = [sock for idle in self.idle.values() for sock, _ in idle]
+            self.idle.clear()
+        for sock in idle_sockets:
+            sock.close()
+
+    def _evict_expired(self, origin):
+        # Oldest sockets sit at the left end, drop all that outlived the timeout
+        now = time.monotonic()
+        expired = []
+        with self.lock:
+            idle = self.idle.get(origin)
+            while idle and now - idle[0][1] > self.idle_timeout:
+                expired.append(idle.popleft()[0])
+        for sock in expired:
+            sock.close()
+
+    @staticmethod
+    def _is_healthy(sock):
+        # An idle socket must have nothing to read: EOF or stray bytes
+        # mean the origin closed it or the previous response was not drained
+        timeout = sock.gettimeout()
+        sock.setblocking(False)  # A socket timeout would otherwise wait for data
+        try:
+            sock.recv(1, socket.MSG_PEEK)
+        except BlockingIOError:
+            return True
+        except OSError:
+            return False
+        finally:
+            sock.settimeout(timeout)
+        return False
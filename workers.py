@@ -0,0 +1,87 @@
+import os
+import time
+import signal
+import logging
+import logs
+
+RESPAWN_DELAY = 1  # Seconds to wait before replacing a crashed worker
+
+log = logging.getLogger(__name__)
+_exit_hooks = []  # Run by a worker before it exits
+
+
+def at_exit(hook):
+    """Call hook() in each worker before it exits.
+
+    Workers leave through os._exit, which skips atexit handlers, so
+    anything buffered that must reach disk registers here as well.
+    """
+    _exit_hooks.append(hook)
+
+
+def run_workers(count, serve):
+    """Fork count processes running serve(worker_id) and supervise them.
+
+    Every worker binds its own listening socket with SO_REUSEPORT, so the
+    kernel spreads incoming connections across them. A worker that exits
+    is replaced. SIGINT or SIGTERM stops the workers gracefully: each
+    receives SIGTERM, which raises KeyboardInterrupt in it so it runs the
+    same shutdown path as a Ctrl+C in single-process mode.
+    """
+    children = {}  # pid -> worker_id
+    stopping = False
+
+    def spawn(worker_id):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.default_int_handler)
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+            status = 0
+            try:
+                serve(worker_id)
+            except KeyboardInterrupt:
+                pass
+            except Exception as e:
+                log.error("Worker %d failed: %s", worker_id, e)
+                status = 1
+            for hook in _exit_hooks:
+                try:
+                    hook()
+                except Exception as e:
+                    log.error("Worker %d exit hook failed: %s", worker_id, e)
+            logs.shutdown()
+            # Skip interpreter teardown: handler threads would keep us alive
+            os._exit(status)
+        children[pid] = worker_id
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for worker_id in range(count):
+        spawn(worker_id)
+    log.info("Started %d workers", count)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        worker_id = children.pop(pid, None)
+        if worker_id is None or stopping:
+            continue
+        code = os.waitstatus_to_exitcode(status)  # -N when killed by signal N
+        log.warning(
+            "Worker %d (pid %d) exited with status %d, restarting", worker_id, pid, code
+        )
+        time.sleep(RESPAWN_DELAY)
+        if not stopping:
+            spawn(worker_id)
+    log.info("All workers have been shut down.")